@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from os import cpu_count, environ
+from random import Random
+from time import monotonic
+from typing import NamedTuple
+
+import codec
+from engine import game, Move, Player
+from simulate import play_out, random_policy, score
+
+# How long `Advisor.advise` thinks for, by default, in seconds
+ADVISOR_BUDGET = float(environ.get("CASINO_ADVISOR_BUDGET", 0.5))
+# How long each worker runs rollouts before reporting back
+ADVISOR_CHUNK = float(environ.get("CASINO_ADVISOR_CHUNK", 0.02))
+
+
+class Advice(NamedTuple):
+    move: Move
+    # Mean final `ref.Rule` points for the player after making `move`
+    score: float
+    rollouts: int
+
+
+def determinize(state, player, rnd):
+    """A `State` `player` can't tell apart from `state`
+
+    Only the deck and the other players' hands are hidden from them. Those
+    cards are dealt out again at random, everyone keeps as many as they had.
+    """
+    hidden = [*state.deck]
+    for name, hand in state.hands.items():
+        if name != player:
+            hidden += hand
+    rnd.shuffle(hidden)
+
+    deck, hidden = hidden[: len(state.deck)], hidden[len(state.deck) :]
+    hands = {}
+    for name, hand in state.hands.items():
+        if name == player:
+            hands[name] = hand
+        else:
+            hands[name], hidden = hidden[: len(hand)], hidden[len(hand) :]
+    return state._replace(deck=deck, hands=hands)
+
+
+def rollouts(data, player, seed, until, policy=random_policy):
+    """Play out each of `player`'s moves from `codec.encode`d `data` until
+    `until` (a `monotonic` time), returning the total points and rollouts
+    for each move, indexed like `legal_moves`
+
+    Moves take turns in a random order, each round against a fresh
+    `determinize`d state. At least one rollout is always run, and `until` is
+    only checked between them.
+    """
+    state = codec.decode(data)
+    moves = state.legal_moves(player)
+    rnd = Random(seed)
+    totals = [0] * len(moves)
+    counts = [0] * len(moves)
+    while True:
+        sample = determinize(state, player, rnd)
+        for i in rnd.sample(range(len(moves)), len(moves)):
+            final, _ = play_out(sample.with_move(player, moves[i]), rnd, policy)
+            totals[i] += score(final)[player]
+            counts[i] += 1
+            if monotonic() >= until:
+                return totals, counts
+
+
+class Advisor:
+    """Ranks a player's legal moves by Monte Carlo rollouts
+
+    The rollouts are spread over a pool of `workers` processes, kept for the
+    advisor's lifetime since starting them takes longer than a short budget.
+    With ``workers=0`` everything runs in this process instead.
+    """
+
+    def __init__(self, workers=None, chunk=ADVISOR_CHUNK, policy=random_policy):
+        self.workers = cpu_count() if workers is None else workers
+        self.chunk = chunk
+        self.policy = policy
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def advise(self, state, player, budget=ADVISOR_BUDGET, seed=None):
+        """Yield `player`'s moves ranked best first, as `Advice`, each time
+        more rollouts come in
+
+        Stops once `budget` seconds have passed, the last ranking yielded is
+        the final answer. Nothing is yielded if it isn't `player`'s turn.
+        """
+        deadline = monotonic() + budget
+        moves = state.legal_moves(player)
+        if len(moves) <= 1:
+            if moves:
+                yield [Advice(moves[0], float("nan"), 0)]
+            return
+
+        data = codec.encode(state)
+        rnd = Random(seed)
+        totals = [0] * len(moves)
+        counts = [0] * len(moves)
+
+        def ranking(result):
+            for i, (total, count) in enumerate(zip(*result)):
+                totals[i] += total
+                counts[i] += count
+            advice = [
+                Advice(move, total / count, count)
+                for move, total, count in zip(moves, totals, counts)
+                if count
+            ]
+            return sorted(advice, key=lambda a: a.score, reverse=True)
+
+        def task():
+            until = min(deadline, monotonic() + self.chunk)
+            return data, player, rnd.getrandbits(64), until, self.policy
+
+        if not self.workers:
+            while monotonic() < deadline:
+                yield ranking(rollouts(*task()))
+            return
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        pending = {self._pool.submit(rollouts, *task()) for _ in range(self.workers)}
+        while pending:
+            timeout = max(0, deadline - monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Out of time, anything still running finishes on its own
+                break
+            for f in done:
+                yield ranking(f.result())
+            if monotonic() < deadline:
+                pending |= {self._pool.submit(rollouts, *task()) for _ in done}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=float, default=ADVISOR_BUDGET)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    players = [Player(name=f"Player {i}") for i in range(1, args.players + 1)]
+    state = game(players, seed=args.seed)
+    player = state.player_order[0].name
+    print(state.render())
+
+    start = monotonic()
+    with Advisor(workers=args.workers) as advisor:
+        for advice in advisor.advise(state, player, args.budget, seed=args.seed):
+            total = sum(a.rollouts for a in advice)
+            print(f"\r{monotonic() - start:6.3f}s {total:>8,} rollouts", end="")
+    print()
+    for a in advice:
+        print(f"{a.score:6.2f} points {a.rollouts:>6,} rollouts  {a.move}")
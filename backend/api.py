@@ -4,24 +4,100 @@ from starlette.requests import Request
 
 # from starlette.responses import JSONResponse
 
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 
-from engine import game, Player, State
+from broadcast import Broadcaster, delta
+from cache import CACHE_SIZE, StateCache
+import codec
+from engine import game, MissingPlayerException, Move, NotTurnException, Player, State
+import database
 from database import (
+    ActionRequest,
+    ActionResponse,
     create_game,
     CreateNewGameRequest,
-    get_game_state,
+    get_current_state,
     init_db,
     insert_game_state,
     NewGameResponse,
+    insert_action,
+    MissingGame,
+    read,
+    VersionConflict,
+    write,
 )
+from metrics import LoopMonitor, MetricsMiddleware, registry, span
+from notify import Notifier
+import offload
+from offload import Overloaded
+from view import PlayerView
 
 logger = getLogger("uvicorn")
 
+# Games that are being played get polled constantly, keep them at hand
+states = StateCache()
+# Serialized `PlayerView`s by (game id, player), at the version they were made
+views = StateCache(maxsize=4 * CACHE_SIZE)
+broadcaster = Broadcaster()
+
+# Other workers' changes to games, see `sync_game`
+notifier = Notifier(lambda game_id, version: sync_game(game_id, version))
+
+loop_monitor = LoopMonitor()
+
 app = FastAPI(
-    on_startup=[init_db],
-    on_shutdown=[],  # Lets keep the db for now?
+    on_startup=[init_db, notifier.start, loop_monitor.start],
+    # Lets keep the db for now?
+    on_shutdown=[notifier.stop, loop_monitor.stop, offload.engine.close],
 )
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, e: Overloaded):
+    # Too much is queued for the database or the engine, shed the request
+    # now rather than answer it late
+    return JSONResponse(
+        {"detail": str(e)}, status_code=503, headers={"Retry-After": "1"}
+    )
+
+
+@registry.collector("casino_cache_hits_total", "counter", "Cache lookups that hit")
+def _cache_hits():
+    return [({"cache": "states"}, states.hits), ({"cache": "views"}, views.hits)]
+
+
+@registry.collector("casino_cache_misses_total", "counter", "Cache lookups that missed")
+def _cache_misses():
+    return [({"cache": "states"}, states.misses), ({"cache": "views"}, views.misses)]
+
+
+@registry.collector("casino_db_writes_total", "counter", "Writes committed")
+def _db_writes():
+    return [({}, sum(gc.writes for gc in database._group_commits.values()))]
+
+
+@registry.collector("casino_db_batches_total", "counter", "Transactions committed")
+def _db_batches():
+    return [({}, sum(gc.batches for gc in database._group_commits.values()))]
+
+
+_offloads = {
+    "db_read": database.readers,
+    "db_write": database.writer,
+    "engine": offload.engine,
+}
+
+
+@registry.collector("casino_offload_running", "gauge", "Calls running off the event loop")
+def _offload_running():
+    return [({"pool": name}, o.running) for name, o in _offloads.items()]
+
+
+@registry.collector("casino_offload_waiting", "gauge", "Calls waiting for a pool")
+def _offload_waiting():
+    return [({"pool": name}, o.waiting) for name, o in _offloads.items()]
 
 
 @app.get("/", description="Proof of life")
@@ -30,30 +106,85 @@ def index():
     return {"ping": "pong"}
 
 
+@app.get("/metrics", description="Prometheus metrics", include_in_schema=False)
+def metrics():
+    return Response(
+        content=registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.post("/v1/game/create", response_model=NewGameResponse)
 async def game_create(request: Request, cgr: CreateNewGameRequest, response: Response):
     # XXX: Hack CORS for now.
     response.headers["Access-Control-Allow-Origin"] = request.headers["Origin"]
 
     players = [Player(name=p) for p in cgr.players]
-    if not (game_id := create_game(players)):
+    # # XXX: Just mock for now. Create a new game
+    state = game(players)
+    if not (game_id := await write(_create_game, players, state)):
         return NewGameResponse(
             players=cgr.players, game_id=None, error="Unable to create game"
         )
-
-    # # XXX: Just mock for now. Create a new game
-    state = game(players)
-    insert_game_state(game_id, state.dict())
+    states.put(game_id, 0, state)
 
     return NewGameResponse(players=cgr.players, game_id=game_id)
 
 
+def _create_game(c, players, state):
+    # The game and its first state are saved in one transaction
+    if not (game_id := create_game(c, players)):
+        return None
+    insert_game_state(c, game_id, state)
+    return game_id
+
+
 @app.post(
     "/v1/game/action",
     description="Preform an action within a game. Valid actions are `discard`, `build`, `capture`",
+    response_model=ActionResponse,
+    responses={409: {"description": "The game moved on, reload it and retry"}},
 )
-def game_action():
-    return {"action": "build, capture, discard"}
+async def game_action(request: Request, ar: ActionRequest, response: Response):
+    # XXX: Hack CORS for now.
+    response.headers["Access-Control-Allow-Origin"] = request.headers["Origin"]
+
+    version, state = await load_state(ar.game_id)
+    if ar.version is not None and ar.version > version:
+        # The client saw a move this worker hasn't, made by another one.
+        # Catch up rather than wait for the `notifier`.
+        states.invalidate(ar.game_id, ar.version)
+        version, state = await load_state(ar.game_id)
+    if ar.version is not None and ar.version != version:
+        raise _conflict(ar.game_id, version)
+
+    target = tuple(ar.target) if isinstance(ar.target, list) else ar.target
+    move = Move(ar.action, ar.card_idx, target)
+    try:
+        with span("engine.with_move"):
+            new_state = await offload.with_move(state, ar.player, move)
+    except MissingPlayerException as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (NotTurnException, ValueError, IndexError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e) or "Invalid move")
+
+    # Only the action is stored, `insert_action` refuses it if another move
+    # got in first. Nothing is locked, so games never wait on each other.
+    try:
+        await write(insert_action, ar.game_id, version + 1, ar.player, move, new_state)
+    except VersionConflict:
+        states.invalidate(ar.game_id, version + 1)
+        raise _conflict(ar.game_id, version)
+    await publish_state(ar.game_id, version + 1, state, new_state)
+
+    return ActionResponse(game_id=ar.game_id, version=version + 1)
+
+
+def _conflict(game_id, version):
+    return HTTPException(
+        status_code=409,
+        detail=f"Game {game_id} is no longer at version {version}",
+        headers={"Retry-After": "0"},
+    )
 
 
 @app.get(
@@ -61,10 +192,111 @@ def game_action():
     description="Return the state of a game",
     response_model=State,
 )
-async def game_state(request: Request, game_id: int, response: Response):
-    # XXX: Hack CORS for now.
-    response.headers["Access-Control-Allow-Origin"] = request.headers["Origin"]
+async def game_state(request: Request, game_id: int):
+    _, state = await load_state(game_id)
+    # States are only ever built by the engine or `codec`, skip re-validating
+    # them through `response_model` on the way out
+    with span("codec.to_json"):
+        content = await offload.to_json(state)
+    return Response(
+        content=content,
+        media_type="application/json",
+        # XXX: Hack CORS for now.
+        headers={"Access-Control-Allow-Origin": request.headers["Origin"]},
+    )
+
+
+@app.get(
+    "/v1/game/{game_id}/view/{player}/",
+    description="Return what `player` can see of a game",
+    response_model=PlayerView,
+)
+async def game_view(request: Request, game_id: int, player: str):
+    version, state = await load_state(game_id)
+    if (content := views.get((game_id, player), version)) is None:
+        try:
+            with span("view.to_json"):
+                content = await offload.view_json(state, version, player)
+        except MissingPlayerException as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        views.put((game_id, player), version, content)
+
+    return Response(
+        content=content,
+        media_type="application/json",
+        # XXX: Hack CORS for now.
+        headers={"Access-Control-Allow-Origin": request.headers["Origin"]},
+    )
+
+
+@app.websocket("/v1/game/{game_id}/ws")
+async def game_ws(websocket: WebSocket, game_id: int):
+    """Push every change to a game instead of polling its state
+
+    Sends the full state once, ``{"version": ..., "state": ...}``, and then a
+    `broadcast.delta` for each new version. Deltas with a version at or below
+    the state's can be ignored.
+    """
+    await websocket.accept()
+    broadcaster.subscribe(game_id, websocket)
+    try:
+        version, state = await load_state(game_id)
+        # Through the outbox, so it can't overtake or be overtaken by a delta
+        broadcaster.send(
+            game_id, websocket, {"version": version, "state": codec.to_dict(state)}
+        )
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except HTTPException as e:
+        # Already accepted, so it's a close code rather than a status
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
+    finally:
+        broadcaster.unsubscribe(game_id, websocket)
+
+
+async def load_state(game_id):
+    """The current version and `State` of a game, from the cache if possible
+
+    Raises a 404 if there's no such game.
+    """
+    # One lookup, the entry could expire between two
+    if (found := states.lookup(game_id)) is not None:
+        return found
+
+    try:
+        version, state = await read(get_current_state, game_id)
+    except MissingGame:
+        raise HTTPException(status_code=404, detail=f"No game {game_id}")
+    states.put(game_id, version, state)
+    return version, state
+
+
+async def publish_state(game_id, version, old, new):
+    """Tell the game's subscribers about a new state"""
+    states.put(game_id, version, new)
+    if broadcaster.subscribers(game_id):
+        broadcaster.publish(game_id, delta(version, old, new))
+
+
+async def sync_game(game_id, version):
+    """Catch up with a game that changed, possibly in another worker
+
+    A game nobody here is watching is just dropped from the cache, the next
+    request loads it. Subscribers get the delta from the state this worker
+    last had, or the whole state if it didn't have one.
+    """
+    if (cached := states.version(game_id)) is not None and cached >= version:
+        return
+    if not broadcaster.subscribers(game_id):
+        states.invalidate(game_id, version)
+        return
 
-    gs = get_game_state(game_id)
-    state = State(**gs)
-    return state
+    old = states.get(game_id, count=False)
+    version, new = await read(get_current_state, game_id)
+    if old is not None:
+        await publish_state(game_id, version, old, new)
+        return
+    states.put(game_id, version, new)
+    broadcaster.publish(game_id, {"version": version, "state": codec.to_dict(new)})
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Latency of `/v1/game/action` through the whole app, in process
+
+Plays `--games` games at once, each sending its moves one after another
+through `httpx.AsyncClient(app=app)`, and reports per-action percentiles.
+
+    python -m bench.actions [--games N]
+"""
+
+from argparse import ArgumentParser
+from asyncio import gather, run
+from os import environ
+from pathlib import Path
+from random import Random
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from httpx import AsyncClient
+
+HEADERS = {"Origin": "http://localhost"}
+PLAYERS = ["Hyacinth", "Rose", "Daisy", "Onslow"]
+
+
+# Shared by every harness that drives the API, see `bench.suite` and
+# `bench.load`
+
+
+def dealt(names):
+    """The first `State` of a game the API made for `names`
+
+    Every game is dealt the same (see `api.game_create`), so a harness can
+    follow its games locally instead of fetching their states.
+    """
+    from engine import game, Player
+
+    return game([Player(name=name) for name in names])
+
+
+def action_body(game_id, player, move, version):
+    """The ``/v1/game/action`` request for `move`, chosen at `version`"""
+    target = [*move.target] if isinstance(move.target, tuple) else move.target
+    return {
+        "game_id": game_id,
+        "player": player,
+        "action": move.action,
+        "card_idx": move.card_idx,
+        "target": target,
+        "version": version,
+    }
+
+
+async def play(client, seed, latencies):
+    r = await client.post("/v1/game/create", json={"players": PLAYERS}, headers=HEADERS)
+    game_id = r.json()["game_id"]
+    state = dealt(PLAYERS)
+    rnd = Random(seed)
+    version = 0
+    while not state.is_over:
+        player = state.player_order[0].name
+        move = rnd.choice(state.legal_moves(player))
+        body = action_body(game_id, player, move, version)
+        start = perf_counter()
+        r = await client.post("/v1/game/action", json=body, headers=HEADERS)
+        latencies.append(perf_counter() - start)
+        r.raise_for_status()
+        state = state.with_move(player, move)
+        version += 1
+
+
+async def main(games):
+    from api import app
+    from database import init_db
+
+    init_db()
+    latencies = []
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        start = perf_counter()
+        await gather(*(play(client, seed, latencies) for seed in range(games)))
+        elapsed = perf_counter() - start
+    return latencies, elapsed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--games", type=int, default=20)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        environ["CASINO_DB"] = str(Path(tmp) / "bench.db")
+        latencies, elapsed = run(main(args.games))
+
+    cuts = quantiles(latencies, n=100)
+    print(f"{len(latencies):,} actions, {len(latencies) / elapsed:,.0f}/s")
+    for name, q in [("p50", cuts[49]), ("p90", cuts[89]), ("p99", cuts[98])]:
+        print(f"{name:<5} {q * 1e3:>8.2f} ms")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""States per second through `codec`, against the JSON it replaced
+
+Storage used to be ``json.dumps(state.dict())`` and ``State(**json.loads(...))``,
+responses went through ``state.dict()`` and FastAPI's own validation and JSON.
+
+    python -m bench.codec [--states N]
+"""
+
+from argparse import ArgumentParser
+from json import dumps, loads
+from time import perf_counter
+
+import codec
+from engine import game, Player, State
+
+PLAYERS = [
+    Player(name="Hyacinth"),
+    Player(name="Rose"),
+    Player(name="Daisy"),
+    Player(name="Onslow"),
+]
+
+
+def states(n):
+    """States from every point of a few games, so the table and piles vary"""
+    out = []
+    seed = 0
+    while len(out) < n:
+        state = game(PLAYERS, seed=seed)
+        while not state.is_over and len(out) < n:
+            out.append(state)
+            player = state.player_order[0].name
+            state = state.with_move(player, state.legal_moves(player)[-1])
+        seed += 1
+    return out
+
+
+def per_second(fn, items):
+    start = perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (perf_counter() - start)
+
+
+def report(name, before, after):
+    print(
+        f"{name:<8} {before:>12,.0f} /s {after:>12,.0f} /s"
+        f" {after / before:>8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--states", type=int, default=2_000)
+    args = parser.parse_args()
+
+    sample = states(args.states)
+    as_json = [dumps(s.dict()) for s in sample]
+    as_bytes = [codec.encode(s) for s in sample]
+
+    print(f"{'':<8} {'json':>15} {'codec':>15} {'speedup':>9}")
+    report(
+        "encode",
+        per_second(lambda s: dumps(s.dict()), sample),
+        per_second(codec.encode, sample),
+    )
+    report(
+        "decode",
+        per_second(lambda j: State(**loads(j)), as_json),
+        per_second(codec.decode, as_bytes),
+    )
+    report(
+        "respond",
+        per_second(lambda s: dumps(State(**s.dict()).dict()), sample),
+        per_second(codec.to_json, sample),
+    )
+
+    size = sum(map(len, as_json)) / sum(map(len, as_bytes))
+    print(f"{'size':<8} {size:>37.1f}x smaller")
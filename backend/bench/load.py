@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Load test the API with simulated players
+
+Serves `api.app` in this process, through httpx's ASGI transport or, with
+``--serve``, a uvicorn on a loopback port. ``--url`` points at a server that
+is already running instead, like the docker stack.
+
+Each of `--players` virtual players sits at a table of `--seats`. They poll
+``/v1/game/{id}/state/`` every `--poll` seconds and take `--think` seconds to
+move once it's their turn, both jittered so players don't act in step. The
+first seat creates a new game whenever the table's last one ends.
+
+    python -m bench.load [--players 1000] [--duration 30] [--serve | --url URL]
+
+Reports throughput, latency percentiles and error rates by endpoint. A 409
+means another writer got to the game first, those are counted as conflicts
+rather than errors. With the ASGI transport the players and the app share
+one event loop, so the latencies include the players' own time.
+"""
+
+from argparse import ArgumentParser
+from asyncio import create_task, gather, run, sleep
+from collections import Counter, defaultdict
+from json import dumps
+from os import environ
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter
+
+from httpx import AsyncClient, HTTPError, Limits, Timeout
+
+from bench.actions import action_body, dealt, HEADERS
+
+PERCENTILES = [50, 90, 99]
+
+
+class Stats:
+    """Latencies and response statuses by endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    async def request(self, endpoint, send):
+        """``await send()``, timed under `endpoint`, `None` when it failed
+        without a response"""
+        start = perf_counter()
+        try:
+            response = await send()
+        except HTTPError as e:
+            response, status = None, type(e).__name__
+        else:
+            status = response.status_code
+        self.latencies[endpoint].append(perf_counter() - start)
+        self.statuses[endpoint][status] += 1
+        return response
+
+    def report(self, elapsed):
+        """Per endpoint, and for all of them under ``"total"``"""
+        report = {}
+        names = [*self.latencies, "total"]
+        for name in names:
+            if name == "total":
+                latencies = [t for ts in self.latencies.values() for t in ts]
+                statuses = sum(self.statuses.values(), Counter())
+            else:
+                latencies, statuses = self.latencies[name], self.statuses[name]
+            latencies = sorted(latencies)
+            requests = len(latencies)
+            errors = sum(
+                n for s, n in statuses.items() if not isinstance(s, int) or s >= 400
+            )
+            report[name] = {
+                "requests": requests,
+                "per_second": requests / elapsed,
+                **{f"p{q}": _percentile(latencies, q) for q in PERCENTILES},
+                "max": latencies[-1] if latencies else None,
+                "conflicts": statuses[409] / requests if requests else 0,
+                "errors": (errors - statuses[409]) / requests if requests else 0,
+                "statuses": {str(s): n for s, n in sorted(statuses.items(), key=str)},
+            }
+        return report
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, len(ordered) * q // 100)]
+
+
+class Table:
+    """One game at a time, shared by the players sitting at it
+
+    Players only move on their turn, so the table follows the game locally
+    instead of parsing every state it polls.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.game_id = None
+        self.state = None
+        self.version = 0
+
+
+async def create(client, stats, table):
+    response = await stats.request(
+        "create",
+        lambda: client.post(
+            "/v1/game/create", json={"players": table.names}, headers=HEADERS
+        ),
+    )
+    if response is None or response.status_code != 200:
+        return
+    table.game_id = response.json()["game_id"]
+    table.state = dealt(table.names)
+    table.version = 0
+
+
+async def player(client, stats, table, seat, deadline, poll, think, rnd):
+    name = table.names[seat]
+    while monotonic() < deadline:
+        await sleep(poll * rnd.uniform(0.5, 1.5))
+        if table.game_id is None or table.state.is_over:
+            if seat == 0:
+                await create(client, stats, table)
+            continue
+
+        game_id = table.game_id
+        await stats.request(
+            "state",
+            lambda: client.get(f"/v1/game/{game_id}/state/", headers=HEADERS),
+        )
+        state = table.state
+        if state.player_order[0].name != name:
+            continue
+
+        await sleep(think * rnd.uniform(0.5, 1.5))
+        move = rnd.choice(state.legal_moves(name))
+        body = action_body(game_id, name, move, table.version)
+        response = await stats.request(
+            "action",
+            lambda: client.post("/v1/game/action", json=body, headers=HEADERS),
+        )
+        if response is not None and response.status_code == 200:
+            table.state = state.with_move(name, move)
+            table.version += 1
+        elif response is not None and response.status_code == 409:
+            # Someone else played this game, start a fresh one
+            table.game_id = None
+
+
+async def load(client, players=1000, seats=4, duration=10, poll=1.0, think=0.5, seed=0):
+    """Run the virtual players against `client` for `duration` seconds,
+    returning their `Stats` and how long they ran"""
+    rnd = Random(seed)
+    stats = Stats()
+    tables = [
+        Table([f"Player {seat}" for seat in range(1, seats + 1)])
+        for _ in range(-(-players // seats))
+    ]
+    start = monotonic()
+    deadline = start + duration
+    await gather(
+        *(
+            player(
+                client,
+                stats,
+                tables[i // seats],
+                i % seats,
+                deadline,
+                poll,
+                think,
+                Random(rnd.getrandbits(64)),
+            )
+            for i in range(players)
+        )
+    )
+    return stats, monotonic() - start
+
+
+async def _serve(app):
+    """Start uvicorn with `app` on a free loopback port"""
+    from uvicorn import Config, Server
+
+    server = Server(Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    task = create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def main(args):
+    options = dict(
+        limits=Limits(max_connections=args.connections),
+        timeout=Timeout(args.timeout),
+    )
+    load_args = (
+        args.players,
+        args.seats,
+        args.duration,
+        args.poll,
+        args.think,
+        args.seed,
+    )
+    if args.url:
+        async with AsyncClient(base_url=args.url, **options) as client:
+            return await load(client, *load_args)
+
+    from api import app
+
+    if args.serve:
+        server, task, url = await _serve(app)
+        try:
+            async with AsyncClient(base_url=url, **options) as client:
+                return await load(client, *load_args)
+        finally:
+            server.should_exit = True
+            await task
+
+    # The ASGI transport doesn't run the app's startup and shutdown
+    await app.router.startup()
+    try:
+        async with AsyncClient(app=app, base_url="http://load", **options) as client:
+            return await load(client, *load_args)
+    finally:
+        await app.router.shutdown()
+
+
+def _format(report):
+    lines = [
+        f"{'':<8} {'requests':>9} {'/s':>8}"
+        + "".join(f"{f'p{q}':>10}" for q in PERCENTILES)
+        + f"{'max':>10} {'errors':>8} {'409s':>8}"
+    ]
+    for name, r in report.items():
+        times = [r[f"p{q}"] for q in PERCENTILES] + [r["max"]]
+        lines.append(
+            f"{name:<8} {r['requests']:>9,} {r['per_second']:>8,.0f}"
+            + "".join("       -  " if t is None else f"{t * 1e3:>7.1f} ms" for t in times)
+            + f" {r['errors']:>8.2%} {r['conflicts']:>8.2%}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--seats", type=int, default=4, help="players per game")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between polls")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds to move")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--serve", action="store_true", help="through a local uvicorn")
+    group.add_argument("--url", help="a server that's already running")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        environ.setdefault("CASINO_DB", str(Path(tmp) / "load.db"))
+        stats, elapsed = run(main(args))
+
+    report = stats.report(elapsed)
+    print(dumps(report, indent=2) if args.json else _format(report))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Latest-state lookups in `database` as the state table grows
+
+Fills a scratch database with `--games` games of `--states` snapshots each,
+then times `get_game_state` against the old unindexed
+``SELECT state FROM state WHERE game_id=? ORDER BY modified DESC``.
+
+    python -m bench.storage [--games 100000] [--states 100]
+
+Every snapshot is the same encoded deal, the blob's contents don't change how
+long it takes to find the right row.
+"""
+
+from argparse import ArgumentParser
+from os import environ
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+LEGACY_QUERY = (
+    "SELECT state FROM state NOT INDEXED WHERE game_id=? ORDER BY modified DESC"
+)
+
+
+def populate(database, games, states):
+    database.init_db()
+    with database.pool.transaction() as c:
+        _populate(c, games, states)
+
+
+def _populate(c, games, states):
+    from codec import encode
+    from engine import game, Player
+
+    blob = encode(game([Player(name="a"), Player(name="b")]))
+    c.executemany(
+        "INSERT INTO game (id, players) VALUES (?, '{\"players\": []}')",
+        ((g,) for g in range(1, games + 1)),
+    )
+    c.executemany(
+        "INSERT INTO state (game_id, version, state) VALUES (?, ?, ?)",
+        ((g, v, blob) for v in range(states) for g in range(1, games + 1)),
+    )
+    c.execute(
+        """
+        INSERT INTO current_state (game_id, version, state_id)
+        SELECT game_id, MAX(version), MAX(id) FROM state GROUP BY game_id
+        """
+    )
+
+
+def per_lookup(lookup, game_ids):
+    start = perf_counter()
+    for gid in game_ids:
+        lookup(gid)
+    return (perf_counter() - start) / len(game_ids)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--games", type=int, default=1_000)
+    parser.add_argument("--states", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=1_000)
+    parser.add_argument("--legacy-lookups", type=int, default=20)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        environ["CASINO_DB"] = str(Path(tmp) / "bench.db")
+        import database
+
+        start = perf_counter()
+        populate(database, args.games, args.states)
+        print(
+            f"{args.games:,} games / {args.games * args.states:,} states"
+            f" in {perf_counter() - start:.1f}s"
+        )
+
+        rnd = Random(0)
+        game_ids = [rnd.randint(1, args.games) for _ in range(args.lookups)]
+
+        def indexed(gid):
+            with database.pool.reader() as c:
+                return database.get_game_state(c, gid)
+
+        def legacy(gid):
+            with database.pool.reader() as c:
+                return c.execute(LEGACY_QUERY, (gid,)).fetchone()
+
+        indexed = per_lookup(indexed, game_ids)
+        unindexed = per_lookup(legacy, game_ids[: args.legacy_lookups])
+
+        print(f"{'indexed':<10} {indexed * 1e6:>12,.1f} µs/lookup")
+        print(f"{'unindexed':<10} {unindexed * 1e6:>12,.1f} µs/lookup")
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""Every benchmark in one run, checked against committed baselines
+
+Each benchmark is timed for at least `--min-time` seconds per round, and the
+median of `--rounds` rounds is its time per call. ``--save`` records the
+results in `BASELINE`, ``--check`` exits with 1 when a benchmark got more
+than `--tolerance` times slower than its baseline.
+
+    python -m bench.suite [-k NAME] [--save | --check] [--tolerance 1.3]
+
+Baselines only mean something on the machine that made them, re-save them
+there before comparing a change.
+"""
+
+from argparse import ArgumentParser
+from asyncio import all_tasks, gather, new_event_loop
+from itertools import count
+from json import dumps, loads
+from pathlib import Path
+from platform import machine, python_version
+from statistics import median
+from sys import exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from bench.actions import action_body, dealt, HEADERS
+
+BASELINE = Path(__file__).with_name("baseline.json")
+SIZES = [1_000, 10_000, 100_000]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a generator that sets up, yields the function to time, and
+    cleans up once it's resumed"""
+
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+def _players(n=4):
+    from engine import Player
+
+    return [Player(name=f"Player {i}") for i in range(1, n + 1)]
+
+
+def _move_state(action):
+    """A state whose current player can make `action` with their first card"""
+    from engine import game
+
+    players = _players()
+    for seed in count():
+        state = game(players, seed=seed)
+        player = state.player_order[0].name
+        for move in state.legal_moves(player):
+            if move.action == action and move.card_idx == 0:
+                return state, player, move
+
+
+@benchmark("engine.game")
+def _():
+    from engine import game
+
+    players = _players()
+    yield lambda: game(players, seed=0)
+
+
+for _action in ["discard", "build", "capture"]:
+
+    @benchmark(f"engine.with_{_action}")
+    def _(action=_action):
+        state, player, move = _move_state(action)
+        method = getattr(state, f"with_{action}")
+        if action == "discard":
+            yield lambda: method(player, move.card_idx)
+        else:
+            yield lambda: method(player, move.card_idx, move.target)
+
+
+@benchmark("engine.render")
+def _():
+    from engine import game
+
+    state = game(_players(), seed=0)
+    yield state.render
+
+
+@benchmark("ref.score")
+def _():
+    import ref
+    from random import Random
+
+    deck = [*ref.STANDARD_DECK]
+    Random(0).shuffle(deck)
+    players = [
+        ref.Player(f"Player {i}", capture=set(deck[i::4])) for i in range(4)
+    ]
+    yield lambda: ref.score(players)
+
+
+def _database(tmp, size):
+    """A database with `size` snapshots, spread over games of 10 each"""
+    import database
+    from bench.storage import _populate
+
+    database.init_db(str(Path(tmp) / "bench.db"))
+    with database.pool.transaction() as c:
+        _populate(c, size // 10, 10)
+    return database
+
+
+for _size in SIZES:
+
+    @benchmark(f"database.read[{_size}]")
+    def _(size=_size):
+        from random import Random
+
+        with TemporaryDirectory() as tmp:
+            database = _database(tmp, size)
+            rnd = Random(0)
+
+            def read():
+                with database.pool.reader() as c:
+                    return database.get_current_state(c, rnd.randint(1, size // 10))
+
+            yield read
+            database.pool.close()
+            database.pool = None
+
+    @benchmark(f"database.insert[{_size}]")
+    def _(size=_size):
+        from engine import Move
+
+        with TemporaryDirectory() as tmp:
+            database = _database(tmp, size)
+            # Game 1 is at version 9 after its 10 snapshots
+            versions = count(10)
+            move = Move("discard", 0)
+
+            def insert():
+                with database.pool.transaction() as c:
+                    database.insert_action(c, 1, next(versions), "a", move)
+
+            yield insert
+            database.pool.close()
+            database.pool = None
+
+
+def _api():
+    """An in-process client for `api.app`, and a way to run its requests
+
+    Game ids start again in every benchmark's database, so the app gets
+    empty caches too.
+    """
+    from httpx import AsyncClient
+
+    import api
+    from cache import StateCache
+
+    api.states, api.views = StateCache(), StateCache()
+    loop = new_event_loop()
+    client = AsyncClient(app=api.app, base_url="http://bench")
+    return client, loop.run_until_complete, loop
+
+
+def _close(client, loop):
+    loop.run_until_complete(client.aclose())
+    # The database's `GroupCommit` runs for as long as its loop
+    tasks = all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+def _api_benchmark(request):
+    """Time ``await request(client, game_id)`` on a fresh game"""
+
+    def bench():
+        import database
+
+        with TemporaryDirectory() as tmp:
+            database.init_db(str(Path(tmp) / "bench.db"))
+            client, run, loop = _api()
+            response = run(
+                client.post(
+                    "/v1/game/create",
+                    json={"players": [p.name for p in _players()]},
+                    headers=HEADERS,
+                )
+            )
+            game_id = response.json()["game_id"]
+            yield lambda: run(request(client, game_id))
+            _close(client, loop)
+            database.pool.close()
+            database.pool = None
+
+    return bench
+
+
+async def _get_state(client, game_id):
+    response = await client.get(f"/v1/game/{game_id}/state/", headers=HEADERS)
+    response.raise_for_status()
+
+
+async def _get_view(client, game_id):
+    response = await client.get(f"/v1/game/{game_id}/view/Player 1/", headers=HEADERS)
+    response.raise_for_status()
+
+
+BENCHMARKS["api.state"] = _api_benchmark(_get_state)
+BENCHMARKS["api.view"] = _api_benchmark(_get_view)
+
+
+@benchmark("api.action")
+def _():
+    from engine import Move
+
+    def new_game():
+        response = run(
+            client.post(
+                "/v1/game/create",
+                json={"players": [p.name for p in players]},
+                headers=HEADERS,
+            )
+        )
+        return response.json()["game_id"], dealt([p.name for p in players]), 0
+
+    # Discards until the game is over, then starts another. That costs a
+    # game creation every 48 actions, which is in the timing.
+    def action():
+        nonlocal current
+        game_id, state, version = current
+        player = state.player_order[0].name
+        response = run(
+            client.post(
+                "/v1/game/action",
+                json=action_body(game_id, player, discard, version),
+                headers=HEADERS,
+            )
+        )
+        response.raise_for_status()
+        state = state.with_move(player, discard)
+        current = new_game() if state.is_over else (game_id, state, version + 1)
+
+    import database
+
+    players = _players()
+    discard = Move("discard", 0)
+    with TemporaryDirectory() as tmp:
+        database.init_db(str(Path(tmp) / "bench.db"))
+        client, run, loop = _api()
+        current = new_game()
+        yield action
+        _close(client, loop)
+        database.pool.close()
+        database.pool = None
+
+
+def measure(fn, rounds=5, min_time=0.1):
+    """Median seconds per call of `fn` over `rounds` rounds"""
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        if (elapsed := perf_counter() - start) >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    times = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((perf_counter() - start) / number)
+    return median(times)
+
+
+def run(names, rounds=5, min_time=0.1):
+    results = {}
+    for name in names:
+        bench = BENCHMARKS[name]()
+        fn = next(bench)
+        results[name] = measure(fn, rounds=rounds, min_time=min_time)
+        next(bench, None)
+        yield name, results[name]
+
+
+def regressions(results, baseline, tolerance):
+    """The benchmarks more than `tolerance` times slower than `baseline`"""
+    return {
+        name: seconds / baseline[name]
+        for name, seconds in results.items()
+        if name in baseline and seconds > baseline[name] * tolerance
+    }
+
+
+def _format(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("µs", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.1f} ns"
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-k", default="", help="only names containing this")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1)
+    parser.add_argument("--tolerance", type=float, default=1.3)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--save", action="store_true")
+    group.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    baseline = loads(BASELINE.read_text())["results"] if BASELINE.exists() else {}
+    names = [name for name in BENCHMARKS if args.k in name]
+
+    results = {}
+    for name, seconds in run(names, args.rounds, args.min_time):
+        results[name] = seconds
+        was = f"{baseline[name] / seconds:6.2f}x" if name in baseline else ""
+        print(f"{name:<26} {_format(seconds)} {was}", flush=True)
+
+    if args.save:
+        BASELINE.write_text(
+            dumps(
+                {
+                    "python": python_version(),
+                    "machine": machine(),
+                    "results": {**baseline, **results},
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+
+    if args.check and (slower := regressions(results, baseline, args.tolerance)):
+        for name, ratio in slower.items():
+            print(f"{name} is {ratio:.2f}x slower than its baseline")
+        exit(1)
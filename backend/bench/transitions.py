@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Moves per second through the `State.with_*` transitions
+
+Compares the engine's trusted construction (`State._from_trusted`) with what
+every move used to cost, a fully validated `State(...)` after each transition.
+
+    python -m bench.transitions [--games N]
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+
+from engine import game, Player, State
+
+PLAYERS = [
+    Player(name="Hyacinth"),
+    Player(name="Rose"),
+    Player(name="Daisy"),
+    Player(name="Onslow"),
+]
+
+
+def validated(state):
+    # What every transition used to end in: State(deck=..., table=..., ...)
+    return State(**{name: getattr(state, name) for name in State.__fields__})
+
+
+def play(seed, finish=lambda state: state):
+    """Discard round the table until the deck runs out, returning the moves"""
+    state = game(PLAYERS, seed=seed)
+    moves = 0
+    while state.deck:
+        state = finish(state.with_discard(state.player_order[0].name, 0))
+        moves += 1
+    return moves
+
+
+def moves_per_second(games, finish=lambda state: state):
+    start = perf_counter()
+    moves = sum(play(seed, finish) for seed in range(games))
+    return moves / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--games", type=int, default=500)
+    args = parser.parse_args()
+
+    before = moves_per_second(args.games, finish=validated)
+    after = moves_per_second(args.games)
+
+    print(f"{'validated':<10} {before:>12,.0f} moves/s")
+    print(f"{'trusted':<10} {after:>12,.0f} moves/s")
+    print(f"{'speedup':<10} {after / before:>12.1f}x")
@@ -0,0 +1,116 @@
+from asyncio import CancelledError, create_task, Queue, QueueFull, wait_for
+from collections import defaultdict
+from os import environ
+
+# Messages a connection may fall behind by before it's dropped
+BROADCAST_QUEUE = int(environ.get("CASINO_BROADCAST_QUEUE", 64))
+# Seconds one message may take to send before its connection is dropped
+BROADCAST_TIMEOUT = float(environ.get("CASINO_BROADCAST_TIMEOUT", 5))
+# Policy violation, the client isn't keeping up
+SLOW_CLOSE_CODE = 1008
+
+
+def delta(version, old, new):
+    """The message sent to a game's subscribers when `old` becomes `new`
+
+    Only the cards that moved (see `State.diff`), the turn order and the
+    values of the table's units, indexed like the ``("table", index)``
+    locations, instead of the whole state.
+    """
+    return {
+        "version": version,
+        "moved": [
+            {
+                "card": card.dict(),
+                "from": [*src] if src else None,
+                "to": [*dst] if dst else None,
+            }
+            for card, src, dst in old.diff(new)
+        ],
+        "player_order": [p.name for p in new.player_order],
+        "table": [u.value for u in new.table],
+    }
+
+
+class _Subscriber:
+    """One connection's outbox, sent by its own task so a slow client only
+    holds itself up"""
+
+    def __init__(self, websocket, drop):
+        self.websocket = websocket
+        self.outbox = Queue(BROADCAST_QUEUE)
+        self.task = create_task(self._send(drop))
+
+    async def _send(self, drop):
+        try:
+            while True:
+                message = await self.outbox.get()
+                await wait_for(self.websocket.send_json(message), BROADCAST_TIMEOUT)
+        except CancelledError:
+            raise
+        except Exception:
+            # Timed out, or the connection is gone
+            drop(self)
+
+    async def close(self):
+        """Stop sending and close the connection, if it isn't already"""
+        self.task.cancel()
+        try:
+            await wait_for(
+                self.websocket.close(code=SLOW_CLOSE_CODE), BROADCAST_TIMEOUT
+            )
+        except Exception:
+            pass
+
+
+class Broadcaster:
+    """The WebSocket connections subscribed to each game
+
+    Each connection gets an outbox of up to `BROADCAST_QUEUE` messages, so
+    `publish` never waits on a client. One that falls further behind than
+    that, or takes longer than `BROADCAST_TIMEOUT` to take a message, is
+    unsubscribed and closed.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(dict)
+        # Strong references to the `_Subscriber.close` tasks
+        self._closing = set()
+
+    def subscribers(self, game_id):
+        return len(self._subscribers.get(game_id, ()))
+
+    def subscribe(self, game_id, websocket):
+        """Start sending `game_id`'s messages to `websocket`, must be called
+        on the event loop"""
+        self._subscribers[game_id][websocket] = _Subscriber(
+            websocket, lambda subscriber: self._drop(game_id, subscriber)
+        )
+
+    def unsubscribe(self, game_id, websocket):
+        if (sockets := self._subscribers.get(game_id)) is None:
+            return
+        if (subscriber := sockets.pop(websocket, None)) is not None:
+            subscriber.task.cancel()
+        if not sockets:
+            del self._subscribers[game_id]
+
+    def send(self, game_id, websocket, message):
+        """Queue `message` for one connection, behind any already queued"""
+        if (subscriber := self._subscribers.get(game_id, {}).get(websocket)) is None:
+            return
+        try:
+            subscriber.outbox.put_nowait(message)
+        except QueueFull:
+            self._drop(game_id, subscriber)
+
+    def publish(self, game_id, message):
+        """Queue `message` for every connection on the game"""
+        for websocket in [*self._subscribers.get(game_id, ())]:
+            self.send(game_id, websocket, message)
+
+    def _drop(self, game_id, subscriber):
+        self.unsubscribe(game_id, subscriber.websocket)
+        task = create_task(subscriber.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
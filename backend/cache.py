@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from os import environ
+from time import monotonic
+
+CACHE_SIZE = int(environ.get("CASINO_CACHE_SIZE", 1024))
+CACHE_TTL = float(environ.get("CASINO_CACHE_TTL", 300))
+
+
+class StateCache:
+    """The latest `State` of recently used games, by game id
+
+    Holds at most `maxsize` games, evicting the least recently used, and
+    forgets a game `ttl` seconds after its state was stored. Each entry keeps
+    the version it was stored at, a newer version replaces it and an older
+    one is ignored, so a slow write can't put a stale state back.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, clock=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, game_id):
+        return self.get(game_id, count=False) is not None
+
+    def get(self, game_id, version=None, *, count=True):
+        """The cached state, or `None` if it's missing, expired or not `version`"""
+        if (found := self.lookup(game_id, version, count=count)) is None:
+            return None
+        return found[1]
+
+    def lookup(self, game_id, version=None, *, count=True):
+        """Like `get`, but ``(version, state)``, both from the same entry"""
+        entry = self._entries.get(game_id)
+        if entry is not None:
+            cached_version, state, expires = entry
+            if expires <= self.clock() or (
+                version is not None and cached_version != version
+            ):
+                del self._entries[game_id]
+                entry = None
+
+        if entry is None:
+            self.misses += count
+            return None
+
+        self._entries.move_to_end(game_id)
+        self.hits += count
+        return cached_version, state
+
+    def version(self, game_id):
+        """The version of the cached state, or `None`"""
+        if game_id not in self:
+            return None
+        return self._entries[game_id][0]
+
+    def put(self, game_id, version, state):
+        if (entry := self._entries.get(game_id)) and entry[0] > version:
+            return
+        self._entries[game_id] = version, state, self.clock() + self.ttl
+        self._entries.move_to_end(game_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, game_id, version=None):
+        """Drop a game, or only if its cached state is older than `version`"""
+        if (entry := self._entries.get(game_id)) is None:
+            return
+        if version is None or entry[0] < version:
+            del self._entries[game_id]
@@ -1,13 +1,249 @@
+from asyncio import (
+    get_running_loop,
+    Queue as AsyncQueue,
+    QueueEmpty,
+    wait_for,
+)
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from os import environ
+from queue import Queue
+from threading import Lock
 from typing import List
 from json import dumps, loads
-from sqlite3 import connect, PARSE_DECLTYPES
+from weakref import WeakKeyDictionary
+from sqlite3 import connect, IntegrityError, PARSE_DECLTYPES
 
-from pydantic import BaseModel
-from engine import Player
+from pydantic import BaseModel, conint
+import codec
+from engine import game, Move, Player, State
+from metrics import span
+from offload import Offload, Overloaded
+
+# Every action is logged, but a full snapshot of the state is only kept every
+# `SNAPSHOT_INTERVAL` actions. Any other state is replayed from the closest
+# snapshot before it.
+SNAPSHOT_INTERVAL = 16
+
+DB_PATH = environ.get("CASINO_DB", "casino.db")
+DB_READERS = int(environ.get("CASINO_DB_READERS", 4))
+# Writes are grouped into one transaction per `DB_BATCH_SIZE` writes or per
+# `DB_BATCH_DELAY` seconds, whichever comes first. Without a delay a batch is
+# whatever queued up while the previous one was committing.
+DB_BATCH_SIZE = int(environ.get("CASINO_DB_BATCH_SIZE", 64))
+DB_BATCH_DELAY = float(environ.get("CASINO_DB_BATCH_DELAY", 0))
+# Reads, and writes, that may be waiting for the database before the next
+# one raises `Overloaded`
+DB_QUEUE = int(environ.get("CASINO_DB_QUEUE", 1024))
+
+
+class VersionConflict(Exception):
+    """Another action already took the game past the expected version"""
+
+
+class MissingGame(KeyError):
+    """There's no game with that id"""
+
+
+def _row_factory(c, r):
+    return {k: v for k, v in zip([cl[0] for cl in c.description], r)}
+
+
+def _connect(path):
+    # Transactions are started explicitly, see `ConnectionPool`
+    conn = connect(
+        path,
+        detect_types=PARSE_DECLTYPES,
+        check_same_thread=False,
+        isolation_level=None,
+    )
+    conn.row_factory = _row_factory
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+class ConnectionPool:
+    """One writer and a pool of readers over the same SQLite database
+
+    In WAL mode readers never block on the writer or on each other, each read
+    transaction sees the database as of when it started. SQLite only allows
+    one writer at a time, so writes queue up on the single writer connection
+    rather than fighting over the file lock.
+    """
+
+    def __init__(self, path, readers=DB_READERS):
+        self.path = path
+        self._writer = _connect(path)
+        self._write_lock = Lock()
+        self._readers = Queue()
+
+        # An in-memory database only exists for the connection that made it
+        if path == ":memory:":
+            readers = 0
+        else:
+            self._writer.execute("PRAGMA journal_mode = WAL")
+        for _ in range(readers):
+            self._readers.put(_connect(path))
+        self.size = readers
+
+    @contextmanager
+    def _transaction(self, conn, begin):
+        conn.execute(begin)
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @contextmanager
+    def transaction(self):
+        """A write transaction, committed when the block exits cleanly"""
+        with self._write_lock, self._transaction(self._writer, "BEGIN IMMEDIATE") as c:
+            yield c
+
+    @contextmanager
+    def reader(self):
+        """A read-only transaction on one of the pooled readers"""
+        if not self.size:
+            with self.transaction() as c:
+                yield c
+            return
+
+        conn = self._readers.get()
+        try:
+            with self._transaction(conn, "BEGIN") as c:
+                yield c
+        finally:
+            self._readers.put(conn)
+
+    def close(self):
+        self._writer.close()
+        for _ in range(self.size):
+            self._readers.get().close()
+
+
+pool = None
+
+# A thread per pooled reader, any more would only wait for a connection. The
+# writer gets its own, so reads never hold up a commit.
+readers = Offload(
+    lambda: ThreadPoolExecutor(DB_READERS, thread_name_prefix="casino-db-read"),
+    limit=DB_READERS,
+    max_waiting=DB_QUEUE,
+)
+writer = Offload(
+    lambda: ThreadPoolExecutor(1, thread_name_prefix="casino-db-write"), limit=1
+)
+
+
+async def read(fn, *args, **kwargs):
+    """Run `fn(c, *args, **kwargs)` in a read transaction, off the event loop
+
+    Raises `Overloaded` when `DB_QUEUE` reads are already waiting.
+    """
+
+    def work():
+        with span(f"db.{fn.__name__}"), pool.reader() as c:
+            return fn(c, *args, **kwargs)
+
+    return await readers.run(work)
+
+
+class GroupCommit:
+    """Runs writes from concurrent requests together in shared transactions
+
+    Writes that queue up while a batch is committing, up to `max_batch` of
+    them, are committed together as the next batch, so a burst of requests
+    pays for one fsync instead of one each. A `max_delay` holds each batch
+    open that much longer, trading latency for bigger batches. Each write runs in its
+    own savepoint, so one that fails is rolled back on its own and only its
+    caller sees the error. Callers get their result once it is committed.
+    Once `max_queue` writes are waiting, more raise `Overloaded`.
+    """
+
+    def __init__(
+        self, max_batch=DB_BATCH_SIZE, max_delay=DB_BATCH_DELAY, max_queue=DB_QUEUE
+    ):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._queue = AsyncQueue(max_queue)
+        self._task = None
+
+    async def submit(self, fn, *args, **kwargs):
+        if self._task is None:
+            self._task = get_running_loop().create_task(self._run())
+        if self._queue.full():
+            raise Overloaded(f"{self._queue.qsize()} writes are waiting already")
+        done = get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, kwargs, done))
+        return await done
+
+    async def _run(self):
+        loop = get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    if (timeout := deadline - loop.time()) > 0:
+                        batch.append(await wait_for(self._queue.get(), timeout))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except (QueueEmpty, TimeoutError):
+                    break
+
+            try:
+                results = await writer.run(self._commit, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+
+            for (*_, done), (ok, result) in zip(batch, results):
+                if done.cancelled():
+                    continue
+                if ok:
+                    done.set_result(result)
+                else:
+                    done.set_exception(result)
+
+    def _commit(self, batch):
+        results = []
+        with span("db.commit"), pool.transaction() as c:
+            for fn, args, kwargs, _ in batch:
+                c.execute("SAVEPOINT write")
+                try:
+                    with span(f"db.{fn.__name__}"):
+                        results.append((True, fn(c, *args, **kwargs)))
+                except Exception as e:
+                    c.execute("ROLLBACK TO write")
+                    results.append((False, e))
+                c.execute("RELEASE write")
+        self.batches += 1
+        self.writes += len(batch)
+        return results
+
+
+_group_commits = WeakKeyDictionary()
+
+
+def group_commit():
+    """The `GroupCommit` for the running event loop"""
+    loop = get_running_loop()
+    if (gc := _group_commits.get(loop)) is None:
+        gc = _group_commits[loop] = GroupCommit()
+    return gc
+
+
+async def write(fn, *args, **kwargs):
+    """Run `fn(c, *args, **kwargs)` in a write transaction, off the event loop
+
+    Returns once the write is committed, see `GroupCommit`. Raises
+    `Overloaded` when `DB_QUEUE` writes are already waiting.
+    """
+    return await group_commit().submit(fn, *args, **kwargs)
 
-db = connect("casino.db", detect_types=PARSE_DECLTYPES, check_same_thread=False)
-db.row_factory = lambda c, r: {k: v for k, v in zip([cl[0] for cl in c.description], r)}
-c = db.cursor()
 
 class CreateNewGameRequest(BaseModel):
     # Need to validate its not empty 
@@ -18,8 +254,34 @@ class NewGameResponse(BaseModel):
     game_id: int | None
     error: str | None = None
 
-def init_db():
+class ActionRequest(BaseModel):
+    game_id: int
+    player: str
+    action: str
+    # Negative indexes would count from the end, only the API checks moves
+    # before they're logged
+    card_idx: conint(ge=0)
+    target: conint(ge=0) | List[conint(ge=0)] | None = None
+    # The version the move was chosen at, if given the move is only made
+    # while the game is still at that version
+    version: int | None = None
+
+class ActionResponse(BaseModel):
+    game_id: int
+    version: int
+
+def init_db(path=None):
     """Initialize Database"""
+    global pool
+    if pool is not None:
+        pool.close()
+    pool = ConnectionPool(path or DB_PATH)
+
+    with pool.transaction() as c:
+        _create_tables(c)
+
+
+def _create_tables(c):
     c.execute(
         """
         CREATE TABLE IF NOT EXISTS game (
@@ -27,7 +289,8 @@ def init_db():
             created     DATETIME DEFAULT CURRENT_TIMESTAMP,
             modified    DATETIME DEFAULT CURRENT_TIMESTAMP,
             name        TEXT,
-            players     JSON
+            players     JSON,
+            seed        INTEGER DEFAULT 0
         );
         """
     )
@@ -39,45 +302,306 @@ def init_db():
             modified    DATETIME DEFAULT CURRENT_TIMESTAMP,
             game_id     INTEGER,
             state       JSON,
+            version     INTEGER DEFAULT 0,
              
             FOREIGN KEY (game_id) REFERENCES game(id)
         );
         """
     )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS action (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            created     DATETIME DEFAULT CURRENT_TIMESTAMP,
+            game_id     INTEGER,
+            version     INTEGER,
+            player      TEXT,
+            action      TEXT,
+            card_idx    INTEGER,
+            target      TEXT,
+
+            FOREIGN KEY (game_id) REFERENCES game(id)
+        );
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS current_state (
+            game_id     INTEGER PRIMARY KEY,
+            version     INTEGER,
+            state_id    INTEGER,
+            seq         INTEGER DEFAULT 0,
+
+            FOREIGN KEY (game_id) REFERENCES game(id),
+            FOREIGN KEY (state_id) REFERENCES state(id)
+        );
+        """
+    )
+
+    # Bring older databases up to date, `user_version` is how many of the
+    # `MIGRATIONS` have already run.
+    c.execute("PRAGMA user_version")
+    applied = c.fetchone()["user_version"]
+    for version, migration in enumerate(MIGRATIONS[applied:], start=applied + 1):
+        migration(c)
+        c.execute(f"PRAGMA user_version = {version}")
+
+
+def _add_column(c, table, column):
+    name, *_ = column.split()
+    c.execute(f"PRAGMA table_info({table})")
+    if name in {row["name"] for row in c.fetchall()}:
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+    return True
+
+
+def _migrate_action_log(c):
+    """Databases from before the action log"""
+    _add_column(c, "game", "seed INTEGER DEFAULT 0")
+    if _add_column(c, "state", "version INTEGER DEFAULT 0"):
+        # Every older state was a full snapshot, number them in insert order
+        c.execute(
+            """
+            UPDATE state SET version = (
+                SELECT COUNT(*) FROM state AS s
+                WHERE s.game_id = state.game_id AND s.id < state.id
+            )
+            """
+        )
+
+
+def _migrate_current_state(c):
+    """Index states by version and point at each game's latest one"""
+    c.execute(
+        """ CREATE INDEX IF NOT EXISTS state_game_version ON state (game_id, version) """
+    )
+    c.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS action_game_version
+        ON action (game_id, version)
+        """
+    )
+    c.execute(
+        """
+        INSERT OR REPLACE INTO current_state (game_id, version, state_id)
+        SELECT
+            game.id,
+            MAX(
+                (SELECT COALESCE(MAX(version), 0) FROM action WHERE game_id = game.id),
+                (SELECT COALESCE(MAX(version), 0) FROM state WHERE game_id = game.id)
+            ),
+            (
+                SELECT id FROM state WHERE game_id = game.id
+                ORDER BY version DESC, id DESC LIMIT 1
+            )
+        FROM game
+        """
+    )
+
+
+def _migrate_change_feed(c):
+    """Number changes to `current_state` so other workers can follow them"""
+    _add_column(c, "current_state", "seq INTEGER DEFAULT 0")
+    c.execute(
+        """ CREATE INDEX IF NOT EXISTS current_state_seq ON current_state (seq) """
+    )
 
 
-def create_game(players: List[Player]) -> int | None:
+MIGRATIONS = [
+    _migrate_action_log,
+    _migrate_current_state,
+    _migrate_change_feed,
+]
+
+
+def _set_current(c, game_id, version, state_id=None):
+    # Every change takes the next `seq`, there is only ever one writer
+    c.execute(
+        """
+        INSERT INTO current_state (game_id, version, state_id, seq)
+        VALUES (?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM current_state))
+        ON CONFLICT (game_id) DO UPDATE SET
+            version = MAX(version, excluded.version),
+            state_id = COALESCE(excluded.state_id, state_id),
+            seq = excluded.seq
+        """,
+        (game_id, version, state_id),
+    )
+
+
+def last_change(c):
+    """The `seq` of the latest change to any game, see `get_changes`"""
+    c.execute(""" SELECT COALESCE(MAX(seq), 0) AS seq FROM current_state """)
+    return c.fetchone()["seq"]
+
+
+def get_changes(c, after):
+    """The games that changed since `after`, as [(seq, game_id, version)]
+
+    Only a game's latest change is kept, a game that changed twice is listed
+    once at its newer version.
+    """
+    c.execute(
+        """
+        SELECT seq, game_id, version FROM current_state
+        WHERE seq > ? ORDER BY seq
+        """,
+        (after,),
+    )
+    return [(r["seq"], r["game_id"], r["version"]) for r in c.fetchall()]
+
+
+def _insert_snapshot(c, game_id, state, version):
+    # A deck still in the order of the game's seed is stored as the seed
+    c.execute(""" SELECT seed FROM game WHERE id=? """, (game_id,))
+    seed = (c.fetchone() or {"seed": None})["seed"]
+    c.execute(
+        """ INSERT INTO state (state, game_id, version) VALUES (?, ?, ?) """,
+        (codec.encode(state, seed), game_id, version),
+    )
+    _set_current(c, game_id, version, c.lastrowid)
+
+
+def create_game(c, players: List[Player], seed: int = 0) -> int | None:
     """Save a new game"""
     
     # Create a Game
     c.execute(
-        """ INSERT INTO game (players) VALUES (?) """,
+        """ INSERT INTO game (players, seed) VALUES (?, ?) """,
         # There has to be a better way then `dumps`
-        (dumps({"players": [p.dict() for p in players]}),),
+        (dumps({"players": [p.dict() for p in players]}), seed),
     )
     gid = c.lastrowid
 
     return gid
 
-def insert_game_state(game_id, state):
-    """Add a state to a game"""
+def insert_game_state(c, game_id, state: State, version=0):
+    """Add a snapshot of a game's state after `version` actions"""
+
+    _insert_snapshot(c, game_id, state, version)
+
+
+def insert_action(c, game_id, version, player, move, state=None):
+    """Log the action that takes a game to `version`
+
+    `state` is the state the action led to, it is only stored when a snapshot
+    is due. Raises `VersionConflict` unless the game is at `version - 1`, the
+    check and the insert share the write transaction so they can't be raced.
+    """
+
+    c.execute(""" SELECT version FROM current_state WHERE game_id=? """, (game_id,))
+    current = (c.fetchone() or {"version": 0})["version"]
+    if current != version - 1:
+        raise VersionConflict(f"game {game_id} is at version {current}")
+
+    action, card_idx, target = move
+    try:
+        c.execute(
+            """
+            INSERT INTO action (game_id, version, player, action, card_idx, target)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (game_id, version, player, action, card_idx, dumps(target)),
+        )
+    except IntegrityError as e:
+        # `action_game_version`, the action log is ahead of `current_state`
+        raise VersionConflict(f"game {game_id} is past version {version - 1}") from e
+    if state is not None and version % SNAPSHOT_INTERVAL == 0:
+        _insert_snapshot(c, game_id, state, version)
+    else:
+        _set_current(c, game_id, version)
+
+
+def get_actions(c, gid, after=0, upto=None):
+    """Return a game's actions with versions in (`after`, `upto`]"""
 
     c.execute(
-        """ INSERT INTO state (state, game_id) VALUES (?, ?) """,
-        (dumps(state), game_id),
+        """
+        SELECT version, player, action, card_idx, target FROM action
+        WHERE game_id=? AND version>? AND (? IS NULL OR version<=?)
+        ORDER BY version
+        """,
+        (gid, after, upto, upto),
     )
-    db.commit()
+    actions = []
+    for row in c.fetchall():
+        target = loads(row["target"])
+        if isinstance(target, list):
+            target = tuple(target)
+        move = Move(row["action"], row["card_idx"], target)
+        actions.append((row["version"], row["player"], move))
+    return actions
+
+
+def _get_snapshot(c, gid, version=None):
+    c.execute(
+        """
+        SELECT state, version FROM state
+        WHERE game_id=? AND (? IS NULL OR version<=?)
+        ORDER BY version DESC, id DESC
+        """,
+        (gid, version, version),
+    )
+    return c.fetchone()
+
+
+def _load_snapshot(blob):
+    # Snapshots from before `codec` are JSON text
+    if isinstance(blob, str):
+        return State(**loads(blob))
+    return codec.decode(blob)
+
+
+def replay_game_state(c, gid, version=None):
+    """Rebuild a game's `State` at `version`, or its latest state
+
+    Starts from the closest snapshot, or from a fresh deal of the game's seed,
+    and applies the logged actions after it. Raises `MissingGame` if there's
+    no such game.
+    """
+
+    if snapshot := _get_snapshot(c, gid, version):
+        state = _load_snapshot(snapshot["state"])
+        after = snapshot["version"]
+    else:
+        c.execute(""" SELECT players, seed FROM game WHERE id=? """, (gid,))
+        if (_game := c.fetchone()) is None:
+            raise MissingGame(gid)
+        players = [Player(**p) for p in loads(_game["players"])["players"]]
+        state = game(players, seed=_game["seed"])
+        after = 0
+
+    for _, player, move in get_actions(c, gid, after=after, upto=version):
+        state = state.with_move(player, move)
+    return state
+
+
+def get_current_state(c, gid):
+    """Return the current version of a game, and its state at that version
+
+    Raises `MissingGame` if there's no such game.
+    """
 
-def get_game_state(gid):
-    """Return most current state of a game"""
-    
-    # Return the current state of a game 
     c.execute(
-        """ SELECT state FROM state WHERE game_id=? ORDER BY modified DESC """,
+        """
+        SELECT current_state.version, state.state, state.version AS snapshot
+        FROM current_state LEFT JOIN state ON state.id = current_state.state_id
+        WHERE current_state.game_id=?
+        """,
         (gid,),
     )
+    current = c.fetchone()
+    if current and current["state"] and current["version"] == current["snapshot"]:
+        return current["version"], _load_snapshot(current["state"])
 
-    # TODO: Error handling
-    _state = c.fetchone()
-    return loads(_state['state'])
+    version = current["version"] if current else 0
+    return version, replay_game_state(c, gid, version)
 
+
+def get_game_state(c, gid):
+    """Return most current state of a game"""
+
+    # Return the current state of a game 
+    _, state = get_current_state(c, gid)
+    return codec.to_dict(state)
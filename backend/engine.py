@@ -2,14 +2,14 @@
 
 from enum import Enum
 from random import Random
-from typing import Dict, List, ClassVar, Union
+from typing import Dict, List, ClassVar, NamedTuple, Union
 from operator import or_
 from functools import cached_property, reduce
 from itertools import islice, product, tee
 from contextlib import contextmanager
 from collections import defaultdict, deque
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr, validator
 
 nwise = lambda g, *, n=2: zip(*(islice(g, i, None) for i, g in enumerate(tee(g, n))))
 
@@ -45,10 +45,20 @@ class Rank(Enum):
     Ace = "Ace"
 
 
+# Cards are packed as small ints, ``rank * 4 + suit`` (0–51), which is also
+# their position in `STANDARD_DECK`. Everything a card knows about itself is
+# looked up by that code in the tables below `Card`.
+CARD_CODES = {
+    (r.value, s.value): code for code, (r, s) in enumerate(product(Rank, Suit))
+}
+
+
 class Card(BaseModel):
     rank: Rank
     suit: Suit
 
+    _code: int = PrivateAttr()
+
     SUITS: ClassVar[dict] = {
         "Diamond": "\N{black diamond suit}",
         "Club": "\N{black club suit}",
@@ -89,27 +99,92 @@ class Card(BaseModel):
     class Config:
         # keep_untouched = (cached_property,)
         use_enum_values = True
+        # Cards never change, so every model can share the same instances
+        # instead of copying them on validation.
+        allow_mutation = False
+        copy_on_model_validation = "none"
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        self._code = CARD_CODES[self.rank, self.suit]
+
+    @classmethod
+    def validate(cls, value):
+        # A packed card (see `pack`) is just its code
+        if isinstance(value, int) and not isinstance(value, bool):
+            if not 0 <= value < len(STANDARD_DECK):
+                raise ValueError(f"no card has code {value}")
+            return STANDARD_DECK[value]
+        return super().validate(value)
+
+    @classmethod
+    def from_code(cls, code):
+        return STANDARD_DECK[code]
+
+    @property
+    def code(self):
+        return self._code
 
     @property
     def value(self):
-        return self.VALUES[self.rank]
+        return CARD_VALUES[self._code]
 
     @property
     def symbol(self):
-        if self.suit in {"Heart", "Diamond"}:
-            return (
-                f"\033[1;41m{self.RANKS[self.rank]}{self.SUITS[self.suit]} \033[1;37;0m"
-            )
-        return f"\033[1;7m{self.RANKS[self.rank]}{self.SUITS[self.suit]} \033[1;37;0m"
+        return CARD_SYMBOLS[self._code]
 
     def __hash__(self):
-        return hash((self.rank, self.suit))
+        return self._code
+
+    def __eq__(self, other):
+        if isinstance(other, Card):
+            return self._code == other._code
+        return super().__eq__(other)
+
+
+def _symbol(rank, suit):
+    if suit in {"Heart", "Diamond"}:
+        return f"\033[1;41m{Card.RANKS[rank]}{Card.SUITS[suit]} \033[1;37;0m"
+    return f"\033[1;7m{Card.RANKS[rank]}{Card.SUITS[suit]} \033[1;37;0m"
+
 
+CARD_RANKS = tuple(r for r, _ in CARD_CODES)
+CARD_SUITS = tuple(s for _, s in CARD_CODES)
+CARD_VALUES = tuple(Card.VALUES[r] for r in CARD_RANKS)
+CARD_SYMBOLS = tuple(_symbol(r, s) for r, s in CARD_CODES)
+MAX_VALUE = max(CARD_VALUES)
 
 STANDARD_DECK = [Card(rank=r, suit=s) for r, s in product(Rank, Suit)]
 
 
-class Player(BaseModel):
+def pack(cards):
+    """Pack cards into `bytes`, one code per card"""
+    return bytes(c.code for c in cards)
+
+
+def unpack(codes):
+    """Return the (shared) `Card` for each packed code"""
+    return [STANDARD_DECK[c] for c in codes]
+
+
+def _unpacked(cards):
+    if isinstance(cards, (bytes, bytearray)):
+        return unpack(cards)
+    return cards
+
+
+class TrustedModel(BaseModel):
+    @classmethod
+    def _from_trusted(cls, **values):
+        """Build a model from values the engine made itself, skipping validation
+
+        Only use this for values that already are the right (validated) types,
+        anything coming from outside should go through the normal constructor.
+        """
+        return cls.construct(**values)
+
+
+class Player(TrustedModel):
     name: str
     points: int = 0
 
@@ -117,17 +192,28 @@ class Player(BaseModel):
         # XXX: Hmmm... Can their be two players with the same name?
         return hash((self.name, self.points))
 
+    def __eq__(self, other):
+        if isinstance(other, Player):
+            return (self.name, self.points) == (other.name, other.points)
+        return super().__eq__(other)
+
 
-class Unit(BaseModel):
+class Unit(TrustedModel):
     cards: List[Card]
     value: int | None = None
 
+    _unpack_cards = validator("cards", pre=True, allow_reuse=True)(_unpacked)
+
     def __hash__(self):
-        return hash((tuple(self.cards), self.value))
+        return hash((self.codes, self.value))
+
+    @property
+    def codes(self):
+        return pack(self.cards)
 
     @classmethod
     def from_card(cls, card):
-        return cls(cards=[card], value=card.value)
+        return cls._from_trusted(cards=[card], value=card.value)
 
     def render(self):
         if len(self.cards):
@@ -137,12 +223,130 @@ class Unit(BaseModel):
     def __or__(self, other):
         if self.value is None or other.value is None:
             raise ValueError("cannot combine")
-        if (self.value + other.value) > max(Card.VALUES.values()):
+        if (self.value + other.value) > MAX_VALUE:
             raise ValueError("cannot combine")
-        return Unit(cards=[*self.cards, *other.cards], value=self.value + other.value)
+        return Unit._from_trusted(
+            cards=[*self.cards, *other.cards], value=self.value + other.value
+        )
+
 
+class TableIndex:
+    """Every set of table units whose values add up to at most `MAX_VALUE`
 
-class State(BaseModel):
+    Sets of units are bitmasks over table positions, grouped by their sum, so
+    the units a card of value ``v`` can capture are just ``by_sum[v]``. The
+    index is never changed in place, `append`, `replace` and `remove` return a
+    new index built from this one, which only has to look at the sets that
+    can still be extended rather than the whole powerset of the table.
+    """
+
+    def __init__(self, size=0, by_sum=None):
+        self.size = size
+        self.by_sum = by_sum or tuple(() for _ in range(MAX_VALUE + 1))
+
+    @classmethod
+    def from_units(cls, units):
+        index = cls()
+        for u in units:
+            index = index.append(u.value)
+        return index
+
+    def _with(self, bit, value, by_sum):
+        # Add every set that can take the unit at `bit` without going bust
+        if value is None:
+            return by_sum
+        by_sum = [[*masks] for masks in by_sum]
+        for total in range(MAX_VALUE - value, 0, -1):
+            by_sum[total + value].extend(m | bit for m in by_sum[total])
+        by_sum[value].append(bit)
+        return tuple(tuple(masks) for masks in by_sum)
+
+    def append(self, value):
+        return TableIndex(self.size + 1, self._with(1 << self.size, value, self.by_sum))
+
+    def replace(self, position, value):
+        bit = 1 << position
+        by_sum = tuple(tuple(m for m in masks if not m & bit) for masks in self.by_sum)
+        return TableIndex(self.size, self._with(bit, value, by_sum))
+
+    def remove(self, positions):
+        removed = reduce(or_, (1 << p for p in positions), 0)
+        positions = sorted(positions, reverse=True)
+
+        def compress(mask):
+            for p in positions:
+                mask = (mask & ((1 << p) - 1)) | ((mask >> (p + 1)) << p)
+            return mask
+
+        by_sum = tuple(
+            tuple(compress(m) for m in masks if not m & removed)
+            for masks in self.by_sum
+        )
+        return TableIndex(self.size - len(positions), by_sum)
+
+    def captures(self, value):
+        """Table positions of each set of units adding up to `value`"""
+        if not 0 < value <= MAX_VALUE:
+            return []
+        return [
+            tuple(p for p in range(self.size) if m >> p & 1)
+            for m in self.by_sum[value]
+        ]
+
+
+# Zobrist keys: one random 64-bit key per card in each place it can be, and
+# per whose turn it is. A state's fingerprint (`State.zobrist`) is the XOR of
+# the keys for where everything is, so a move only has to XOR out the keys of
+# what it moved and XOR in their new ones.
+#
+# Players are keyed by their seat, their position in `State.players`. Deck
+# cards are keyed by their position counted from the bottom, which never
+# changes since cards are dealt off the top. Table cards are keyed by the
+# first card of their unit, so the hash knows which cards are built together
+# but not where on the table the unit is. Likewise the order of a hand or a
+# capture pile isn't part of the hash.
+#
+# The most players a deck can seat, four cards each after four on the table
+ZOBRIST_SEATS = (len(STANDARD_DECK) - 4) // 4
+_zobrist_keys = Random(0x5EED)
+_keys = lambda *shape: (
+    [_keys(*shape[1:]) for _ in range(shape[0])]
+    if len(shape) > 1
+    else [_zobrist_keys.getrandbits(64) for _ in range(shape[0])]
+)
+ZOBRIST_DECK = _keys(52, 52)
+ZOBRIST_HAND = _keys(ZOBRIST_SEATS, 52)
+ZOBRIST_CAPTURE = _keys(ZOBRIST_SEATS, 52)
+ZOBRIST_TABLE = _keys(52, 52)
+# Units without a value, by their first card
+ZOBRIST_UNVALUED = _keys(52)
+ZOBRIST_TURN = _keys(ZOBRIST_SEATS)
+del _zobrist_keys, _keys
+
+
+def _unit_zobrist(unit):
+    anchor = unit.cards[0].code if unit.cards else 0
+    keys = ZOBRIST_TABLE[anchor]
+    h = ZOBRIST_UNVALUED[anchor] if unit.value is None else 0
+    for c in unit.cards:
+        h ^= keys[c.code]
+    return h
+
+
+def _pile_zobrist(keys, cards):
+    h = 0
+    for c in cards:
+        h ^= keys[c.code]
+    return h
+
+
+class Move(NamedTuple):
+    action: str
+    card_idx: int
+    target: int | tuple[int, ...] | None = None
+
+
+class State(TrustedModel):
     deck: list[Card]
     table: list[Unit]
     # XXX: Validate no more then six
@@ -151,31 +355,126 @@ class State(BaseModel):
     hands: Dict[str, List[Card]] 
     capture: Dict[str, List[Card]] | None = None
 
-    @contextmanager
-    def players_turn(self, player_name):
-        _player = None
+    _unpack_deck = validator("deck", pre=True, allow_reuse=True)(_unpacked)
+
+    @validator("hands", "capture", pre=True)
+    def _unpack_piles(cls, piles):
+        if piles is None:
+            return piles
+        return {name: _unpacked(cards) for name, cards in piles.items()}
+
+    _table_index: TableIndex | None = PrivateAttr(None)
+    _zobrist: int | None = PrivateAttr(None)
+
+    def _find_player(self, player_name):
         for p in self.players:
             if p.name == player_name:
-                _player = p
-                break
+                return p
+        raise MissingPlayerException(f"Could not find player {player_name!r}")
 
-        if not _player:
-            raise MissingPlayerException(f"Could not find player {player_name!r}")
+    @contextmanager
+    def players_turn(self, player_name):
+        _player = self._find_player(player_name)
 
         # XXX: Think about the equality here
         if _player != self.player_order[0]:
             raise NotTurnException(f"Not {player_name!r}'s turn")
 
-        player = self.player_order.pop(0)
-        try:
-            yield player
-        finally:
-            self.player_order.append(player)
+        yield self.player_order[0]
+
+    # States are never changed in place. Each transition builds new lists only
+    # for the pieces it touches (the deck, the table, one hand, one capture
+    # pile) and shares everything else with the state it came from, so older
+    # states stay valid and keeping a history costs nothing extra.
+
+    def _replace(self, **changes):
+        return self._from_trusted(**{**self.__dict__, **changes})
+
+    def _seat(self, player_name):
+        for seat, p in enumerate(self.players):
+            if p.name == player_name:
+                return seat
+        raise MissingPlayerException(f"Could not find player {player_name!r}")
+
+    def _next_turn(self, table_index=None, zobrist=None, **changes):
+        current, *rest = self.player_order
+        player_order = [*rest, current]
+        # Once the deck runs out players run out of cards at different times,
+        # skip anyone who has nothing left to play
+        hands = changes.get("hands", self.hands)
+        for _ in range(len(player_order) - 1):
+            if hands[player_order[0].name]:
+                break
+            player_order.append(player_order.pop(0))
+
+        state = self._replace(player_order=player_order, **changes)
+        # Only carry the index forward if someone has already paid for it
+        if self._table_index is not None and table_index is not None:
+            state._table_index = table_index(self._table_index)
+        # Same for the hash, `zobrist` gives the keys of the cards that moved
+        if self._zobrist is not None and zobrist is not None:
+            state._zobrist = (
+                self._zobrist
+                ^ zobrist()
+                ^ ZOBRIST_TURN[self._seat(current.name)]
+                ^ ZOBRIST_TURN[self._seat(player_order[0].name)]
+            )
+        return state
+
+    def _deal_zobrist(self, seat):
+        # The keys `_deal` changes, the top card goes from the deck to a hand
+        if not self.deck:
+            return 0
+        top = self.deck[-1].code
+        return ZOBRIST_DECK[top][len(self.deck) - 1] ^ ZOBRIST_HAND[seat][top]
+
+    def _deal(self, hand):
+        # Deal the player another card automatically, while there are any
+        if not self.deck:
+            return self.deck
+        hand.append(self.deck[-1])
+        return self.deck[:-1]
+
+    @property
+    def is_over(self):
+        return not any(self.hands.values())
+
+    @property
+    def zobrist(self):
+        """A 64-bit fingerprint of the state, see `ZOBRIST_DECK`
+
+        Equal states have equal fingerprints. Computed once per game and then
+        kept up to date by each move.
+        """
+        if self._zobrist is None:
+            h = ZOBRIST_TURN[self._seat(self.player_order[0].name)]
+            for position, c in enumerate(self.deck):
+                h ^= ZOBRIST_DECK[c.code][position]
+            for unit in self.table:
+                h ^= _unit_zobrist(unit)
+            for seat, p in enumerate(self.players):
+                h ^= _pile_zobrist(ZOBRIST_HAND[seat], self.hands.get(p.name, ()))
+                if self.capture:
+                    h ^= _pile_zobrist(
+                        ZOBRIST_CAPTURE[seat], self.capture.get(p.name, ())
+                    )
+            self._zobrist = h
+        return self._zobrist
+
+    def __hash__(self):
+        return self.zobrist
+
+    @property
+    def table_index(self):
+        if self._table_index is None:
+            self._table_index = TableIndex.from_units(self.table)
+        return self._table_index
 
     @classmethod
     def from_players(cls, deck, players):
         # XXX: We should fix how this deals and go 2 at a time to everyone.
 
+        deck = [*deck]
         player_order = players
 
         hands = defaultdict(list)
@@ -189,100 +488,186 @@ class State(BaseModel):
         table = [Unit.from_card(deck.pop()) for _ in range(4)]
         hands = {pl_name: cards for pl_name, cards in hands.items()}
 
-        return cls(
+        return cls._from_trusted(
             deck=deck,
             table=table,
-            players=players,
+            players=[*players],
             hands=hands,
             capture={pl.name: [] for pl in players},
-            player_order=player_order,
+            player_order=[*player_order],
         )
 
+    def legal_moves(self, player):
+        """Every `Move` the player can make right now
+
+        A card can always be discarded, built onto any unit it fits on, and
+        capture any set of units that adds up to its value. Units without a
+        value can only be captured on their own, by a card matching all of
+        theirs.
+        """
+        if self._find_player(player) != self.player_order[0]:
+            return []
+
+        table = self.table
+        moves = []
+        for card_idx, card in enumerate(self.hands[player]):
+            moves.append(Move("discard", card_idx))
+            moves.extend(
+                Move("build", card_idx, target_idx)
+                for target_idx, unit in enumerate(table)
+                if unit.value is not None and unit.value + card.value <= MAX_VALUE
+            )
+            moves.extend(
+                Move("capture", card_idx, targets)
+                for targets in self.table_index.captures(card.value)
+            )
+            moves.extend(
+                Move("capture", card_idx, (target_idx,))
+                for target_idx, unit in enumerate(table)
+                if unit.value is None
+                and all(c.value == card.value for c in unit.cards)
+            )
+        return moves
+
+    def with_move(self, player, move):
+        action, card_idx, target = move
+        if action == "discard":
+            return self.with_discard(player, card_idx)
+        if action == "build":
+            return self.with_build(player, card_idx, target)
+        if action == "capture":
+            return self.with_capture(player, card_idx, target)
+        raise ValueError(f"unknown action {action!r}")
+
     def with_discard(self, player, card_idx):
         with self.players_turn(player) as current_player:
-            deck = [*self.deck]
-            table = [*self.table]
-            hands = {}
-            for pl_name, h in self.hands.items():
-                # Discard
-                # XXX: Ugly string compareison... What if two players have the same name
-                if pl_name == current_player.name:
-                    # Players hand
-                    hand = [*self.hands[current_player.name]]
-                    # The card to discard to the table
-                    # Remove from players hand
-                    card = hand.pop(card_idx)
-                    # Add to the tables hand
-                    table.append(Unit.from_card(card))
-                    # Deal the player another card automatically
-                    hand.append(deck.pop())
-                    # Replace the players hand with the new hand
-                    hands[current_player.name] = hand
-                else:
-                    # Not the player so just keep everything the same
-                    hands[pl_name] = h
-
-        # This introduces the df = df(...) idea. Should we write our own
-        # replace? This feels kinda clumbsy.
-        return State(
+            # XXX: Ugly string compareison... What if two players have the same name
+            hand = [*self.hands[current_player.name]]
+            # Remove the card from the players hand and add it to the table
+            card = hand.pop(card_idx)
+            table = [*self.table, Unit.from_card(card)]
+            deck = self._deal(hand)
+
+        def zobrist():
+            seat = self._seat(current_player.name)
+            return (
+                ZOBRIST_HAND[seat][card.code]
+                ^ _unit_zobrist(table[-1])
+                ^ self._deal_zobrist(seat)
+            )
+
+        return self._next_turn(
             deck=deck,
             table=table,
-            players=self.players,
-            hands=hands,
-            capture=self.capture,
-            player_order=self.player_order,
+            hands={**self.hands, current_player.name: hand},
+            table_index=lambda index: index.append(card.value),
+            zobrist=zobrist,
         )
 
     def with_build(self, player, card_idx, target_idx):
         with self.players_turn(player) as current_player:
-            deck = self.deck
-            table = self.table
-            hand = self.hands[current_player.name]
-
+            hand = [*self.hands[current_player.name]]
             card = hand.pop(card_idx)
-            # Add a card to the table unit
-            table[target_idx].cards.append(card)
-            hand.append(deck.pop())
 
-        return State(
+            # Add a card to the table unit, raises if it would go over
+            table = [*self.table]
+            target_idx = range(len(table))[target_idx]
+            unit = table[target_idx] = table[target_idx] | Unit.from_card(card)
+
+            deck = self._deal(hand)
+
+        def zobrist():
+            seat = self._seat(current_player.name)
+            return (
+                ZOBRIST_HAND[seat][card.code]
+                ^ _unit_zobrist(self.table[target_idx])
+                ^ _unit_zobrist(unit)
+                ^ self._deal_zobrist(seat)
+            )
+
+        return self._next_turn(
             deck=deck,
             table=table,
-            players=self.players,
             hands={**self.hands, current_player.name: hand},
-            capture=self.capture,
-            player_order=self.player_order,
+            table_index=lambda index: index.replace(target_idx, unit.value),
+            zobrist=zobrist,
         )
 
     def with_capture(self, player, card_idx, target_idx):
+        """Capture the unit at `target_idx`, or every unit in a sequence of them"""
         with self.players_turn(player) as current_player:
-            deck = self.deck
-            table = self.table
-            hand = self.hands[current_player.name]
-            capture = self.capture[current_player.name]
-
+            hand = [*self.hands[current_player.name]]
             card = hand.pop(card_idx)
 
-            if not all(u.value == card.value for u in table[target_idx].cards):
+            if isinstance(target_idx, int):
+                target_idx = (target_idx,)
+            targets = sorted({range(len(self.table))[t] for t in target_idx})
+            units = [self.table[t] for t in targets]
+
+            if len(units) == 1 and units[0].value is None:
+                captures = all(c.value == card.value for c in units[0].cards)
+            else:
+                values = [u.value for u in units]
+                captures = None not in values and sum(values) == card.value
+            if not captures:
                 raise ValueError(f"cannot capture {target_idx} with {card}")
 
-            # Capture was successful, remove the card and the table card
-            # XXX: Need to add this to capture
-            table_unit_captured = table.pop(target_idx)
+            # Capture was successful, remove the units from the table and add
+            # their cards, and the card that took them, to the capture pile
+            table = [u for t, u in enumerate(self.table) if t not in targets]
+            capture = [
+                *self.capture[current_player.name],
+                *(c for u in units for c in u.cards),
+                card,
+            ]
 
-            # Not sure what capture should look like
-            capture.append(table_unit_captured)
+            deck = self._deal(hand)
 
-            hand.append(deck.pop())
+        def zobrist():
+            seat = self._seat(current_player.name)
+            h = ZOBRIST_HAND[seat][card.code] ^ self._deal_zobrist(seat)
+            h ^= ZOBRIST_CAPTURE[seat][card.code]
+            for unit in units:
+                h ^= _unit_zobrist(unit)
+                h ^= _pile_zobrist(ZOBRIST_CAPTURE[seat], unit.cards)
+            return h
 
-        return State(
+        return self._next_turn(
             deck=deck,
             table=table,
-            players=self.players,
             hands={**self.hands, current_player.name: hand},
             capture={**self.capture, current_player.name: capture},
-            player_order=self.player_order,
+            table_index=lambda index: index.remove(targets),
+            zobrist=zobrist,
         )
 
+    def locations(self):
+        """Where each card is, by card code
+
+        Locations are ``("deck",)``, ``("hand", name)``, ``("table", index)``
+        or ``("capture", name)``.
+        """
+        where = {c.code: ("deck",) for c in self.deck}
+        for name, cards in self.hands.items():
+            where.update((c.code, ("hand", name)) for c in cards)
+        for idx, unit in enumerate(self.table):
+            where.update((c.code, ("table", idx)) for c in unit.cards)
+        for name, cards in (self.capture or {}).items():
+            where.update((c.code, ("capture", name)) for c in cards)
+        return where
+
+    def diff(self, other):
+        """The cards that moved going from this state to `other`
+
+        Returns ``(card, from, to)`` for each of them, see `locations`.
+        """
+        before, after = self.locations(), other.locations()
+        return [
+            (STANDARD_DECK[code], before.get(code), after.get(code))
+            for code in sorted(before.keys() | after.keys())
+            if before.get(code) != after.get(code)
+        ]
+
     def render(self):
         # XXX: Make these line up! This is so annoying
         return "".join(
@@ -298,13 +683,19 @@ class State(BaseModel):
         )
 
 
+def shuffled(seed=0):
+    """The deck `game` deals from with `seed`, dealt from the end
+
+    Cards only ever leave the end of the deck, so a game's deck is always
+    ``shuffled(seed)[:len(state.deck)]``.
+    """
+    deck = [*STANDARD_DECK]
+    Random(seed).shuffle(deck)
+    return deck
+
+
 def game(players, seed=0, _deck=None):
-    rnd = Random(seed)
-    if _deck:
-        deck = _deck
-    else:
-        deck = [c for c in STANDARD_DECK]
-        rnd.shuffle(deck)
+    deck = _deck or shuffled(seed)
     state = State.from_players(deck, players)
 
     return state
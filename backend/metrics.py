@@ -0,0 +1,276 @@
+from asyncio import CancelledError, get_running_loop, sleep
+from bisect import bisect_left
+from collections import Counter
+from logging import getLogger
+from os import environ
+from random import random
+from sys import _current_frames
+from threading import Event, get_ident, Lock, Thread
+from time import perf_counter
+
+METRICS = environ.get("CASINO_METRICS", "1") != "0"
+# The share of requests run under the `Sampler`, 0 to turn it off
+PROFILE_RATE = float(environ.get("CASINO_PROFILE_RATE", 0))
+PROFILE_INTERVAL = float(environ.get("CASINO_PROFILE_INTERVAL", 0.001))
+# How often `LoopMonitor` checks on the event loop, in seconds
+LOOP_INTERVAL = float(environ.get("CASINO_LOOP_INTERVAL", 0.1))
+
+# In seconds, from 100 µs to 10 s
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0,
+)
+
+logger = getLogger("uvicorn")
+
+
+class Histogram:
+    """Counts of observed values by bucket, Prometheus style"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # The last count is for values past the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = Lock()
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            cumulative += count
+            yield f"{name}_bucket", {**labels, "le": str(bound)}, cumulative
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, cumulative
+
+
+class Registry:
+    """Every metric the process exports, see `render`
+
+    Histograms are made on first use, one per set of labels. Counters kept
+    elsewhere, like `StateCache.hits`, are read at render time through
+    `collector`s, so counting them costs nothing extra.
+    """
+
+    def __init__(self):
+        self._help = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = Lock()
+
+    def histogram(self, name, help, **labels):
+        key = name, tuple(sorted(labels.items()))
+        if (h := self._histograms.get(key)) is None:
+            with self._lock:
+                self._help[name] = "histogram", help
+                h = self._histograms.setdefault(key, Histogram())
+        return h
+
+    def collector(self, name, type, help):
+        """Register ``fn() -> [(labels, value)]`` as metric `name`"""
+
+        def register(fn):
+            self._help[name] = type, help
+            self._collectors.append((name, fn))
+            return fn
+
+        return register
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        # Spans are timed from other threads too, don't let them add a
+        # histogram while they're being listed
+        with self._lock:
+            help = {**self._help}
+            histograms = [*self._histograms.items()]
+
+        samples = {name: [] for name in help}
+        for (name, labels), h in histograms:
+            samples[name] += h.samples(name, dict(labels))
+        for name, fn in self._collectors:
+            samples[name] += ((name, labels, value) for labels, value in fn())
+
+        lines = []
+        for name, (type, text) in help.items():
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {type}"]
+            for sample, labels, value in samples[name]:
+                if labels:
+                    labels = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                    sample = f"{sample}{{{labels}}}"
+                lines.append(f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class span:
+    """Time the block into ``casino_span_seconds{span=name}``"""
+
+    __slots__ = "histogram", "start"
+    # By name, so timing a span doesn't need to look up its labels
+    _histograms = {}
+
+    def __init__(self, name):
+        if (h := self._histograms.get(name)) is None:
+            h = self._histograms[name] = registry.histogram(
+                "casino_span_seconds",
+                "Time spent in the engine and the database",
+                span=name,
+            )
+        self.histogram = h
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        if METRICS:
+            self.histogram.observe(perf_counter() - self.start)
+
+
+class LoopMonitor:
+    """Times how late the event loop wakes up a sleeping task
+
+    Every `interval` seconds, into ``casino_event_loop_lag_seconds`` by
+    default. Anything that blocks the loop delays every request on it, and
+    shows up here as lag.
+    """
+
+    def __init__(self, interval=LOOP_INTERVAL, histogram=None):
+        self.interval = interval
+        self.histogram = histogram or registry.histogram(
+            "casino_event_loop_lag_seconds",
+            "How late the event loop ran a timer",
+        )
+        self._task = None
+
+    async def start(self):
+        self._task = get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = get_running_loop()
+        while True:
+            start = loop.time()
+            await sleep(self.interval)
+            self.histogram.observe(max(0, loop.time() - start - self.interval))
+
+
+class Sampler:
+    """A statistical profile of one thread while the block runs
+
+    A background thread records the thread's stack every `interval` seconds,
+    `stacks` counts each ``(file:line function, ...)`` stack, outermost first.
+    On the event loop thread that includes every request running at the
+    time, not just the one being profiled.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            if (frame := _current_frames().get(self.thread_id)) is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{frame.f_lineno} {code.co_name}")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+
+def log_profile(handler, stacks):
+    """The default `profile_hook`, logs the innermost frames seen most"""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack[-1]] += count
+    total = sum(leaves.values())
+    logger.info(
+        "Profile of %s, %s samples:\n%s",
+        handler,
+        total,
+        "\n".join(f"{n / total:6.1%} {frame}" for frame, n in leaves.most_common(10)),
+    )
+
+
+# Called with the handler's name and the `Sampler.stacks` of each sampled
+# request, replace it to send profiles elsewhere
+profile_hook = log_profile
+
+
+class MetricsMiddleware:
+    """Times every HTTP request into ``casino_request_seconds``
+
+    Labelled by the endpoint function that handled it rather than its path,
+    so game ids don't make a new series each. A `PROFILE_RATE` share of the
+    requests are run under a `Sampler`, and passed to `profile_hook`.
+    """
+
+    def __init__(self, app, profile_rate=PROFILE_RATE):
+        self.app = app
+        self.profile_rate = profile_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sampler = Sampler() if random() < self.profile_rate else None
+        start = perf_counter()
+        try:
+            if sampler is None:
+                await self.app(scope, receive, send_status)
+            else:
+                with sampler:
+                    await self.app(scope, receive, send_status)
+        finally:
+            elapsed = perf_counter() - start
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "none")
+            registry.histogram(
+                "casino_request_seconds",
+                "HTTP request latency by handler",
+                handler=handler,
+                method=scope["method"],
+                status=str(status),
+            ).observe(elapsed)
+            if sampler is not None:
+                profile_hook(handler, sampler.stacks)
@@ -0,0 +1,58 @@
+from asyncio import CancelledError, get_running_loop, sleep
+from logging import getLogger
+from os import environ
+
+from database import get_changes, last_change, read
+
+NOTIFY_INTERVAL = float(environ.get("CASINO_NOTIFY_INTERVAL", 0.05))
+
+logger = getLogger("uvicorn")
+
+
+class Notifier:
+    """Follows changes to games made by any worker, through the database
+
+    Every write to a game's `current_state` takes the next ``seq``, so each
+    worker polls for the ``seq`` it hasn't seen yet every `interval` seconds
+    and calls ``await on_change(game_id, version)`` for each changed game.
+    That includes this worker's own changes, `on_change` should ignore
+    versions it already has. Changes made before `start` are skipped.
+    """
+
+    def __init__(self, on_change, interval=NOTIFY_INTERVAL):
+        self.on_change = on_change
+        self.interval = interval
+        self.seq = None
+        self._task = None
+
+    async def start(self):
+        self.seq = await read(last_change)
+        self._task = get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except CancelledError:
+            pass
+        self._task = None
+
+    async def poll(self):
+        """Handle every change since the last poll"""
+        for seq, game_id, version in await read(get_changes, self.seq):
+            self.seq = seq
+            try:
+                await self.on_change(game_id, version)
+            except Exception:
+                logger.exception("Failed to handle game %s version %s", game_id, version)
+
+    async def _run(self):
+        while True:
+            await sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception:
+                # The database is busy or gone, try again next time
+                logger.exception("Failed to poll for changes")
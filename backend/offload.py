@@ -0,0 +1,123 @@
+from asyncio import get_running_loop, Semaphore
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import environ
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+import codec
+import view
+
+# Processes that run engine moves and serialize states, with none they run on
+# the event loop. Each only takes tens of µs, less than the trip to another
+# process, so this only pays off once the event loop is the bottleneck.
+ENGINE_PROCESSES = int(environ.get("CASINO_ENGINE_PROCESSES", 0))
+# Calls that may wait for an engine process before the next is refused
+ENGINE_QUEUE = int(environ.get("CASINO_ENGINE_QUEUE", 256))
+
+
+class Overloaded(Exception):
+    """Too much work is waiting already, try again later"""
+
+
+class Offload:
+    """Runs calls on an executor, at most `limit` at a time from each event
+    loop
+
+    Calls past the `limit` wait their turn on the event loop instead of
+    piling up in the executor's unbounded queue, and once `max_waiting` of
+    them are waiting the next raises `Overloaded`. The executor is made by
+    `make_executor` on first use and shared by every event loop.
+    """
+
+    def __init__(self, make_executor, limit, max_waiting=None):
+        self.make_executor = make_executor
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self._executor = None
+        self._lock = Lock()
+        # Semaphores belong to one event loop
+        self._semaphores = WeakKeyDictionary()
+
+    def _semaphore(self, loop):
+        if (semaphore := self._semaphores.get(loop)) is None:
+            semaphore = self._semaphores[loop] = Semaphore(self.limit)
+        return semaphore
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self.make_executor()
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        loop = get_running_loop()
+        semaphore = self._semaphore(loop)
+        if semaphore.locked():
+            if self.max_waiting is not None and self.waiting >= self.max_waiting:
+                raise Overloaded(f"{self.waiting} calls are waiting already")
+            self.waiting += 1
+            try:
+                await semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await semaphore.acquire()
+
+        self.running += 1
+        try:
+            return await loop.run_in_executor(
+                self._get_executor(), partial(fn, *args, **kwargs)
+            )
+        finally:
+            self.running -= 1
+            semaphore.release()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+engine = Offload(
+    lambda: ProcessPoolExecutor(max_workers=ENGINE_PROCESSES),
+    limit=max(1, ENGINE_PROCESSES),
+    max_waiting=ENGINE_QUEUE,
+)
+
+
+def _call(fn, data, *args):
+    # States go to the engine processes as `codec` bytes, pickling them is
+    # slower
+    return fn(codec.decode(data), *args)
+
+
+async def _run(fn, state, *args):
+    """`fn(state, *args)`, in one of the `ENGINE_PROCESSES` if there are any"""
+    if not ENGINE_PROCESSES:
+        return fn(state, *args)
+    return await engine.run(_call, fn, codec.encode(state), *args)
+
+
+def _with_move(state, player, move):
+    return codec.encode(state.with_move(player, move))
+
+
+async def with_move(state, player, move):
+    """`state.with_move`, see `_run`"""
+    if not ENGINE_PROCESSES:
+        return state.with_move(player, move)
+    return codec.decode(await _run(_with_move, state, player, move))
+
+
+async def to_json(state):
+    """`codec.to_json`, see `_run`"""
+    return await _run(codec.to_json, state)
+
+
+async def view_json(state, version, player):
+    """`view.to_json`, see `_run`"""
+    return await _run(view.to_json, state, version, player)
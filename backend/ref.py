@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+from collections import defaultdict, namedtuple
+from dataclasses import dataclass, field
+from enum import Enum
 from functools import total_ordering
 from itertools import product
 from random import Random
@@ -26,26 +29,113 @@ Suit = Enum(
 Card = namedtuple('Card', 'value suit')
 STANDARD_DECK = [Card(value=v, suit=s) for v, s in product(Value, Suit)]
 
+class Capture(set):
+    '''
+    A set of captured cards that keeps them indexed by suit and value as they
+    are added, so counting them never has to rescan the pile.
+    '''
+    def __init__(self, cards=()):
+        super().__init__()
+        self.by_suit = defaultdict(set)
+        self.by_value = defaultdict(set)
+        self.update(cards)
+
+    def __reduce__(self):
+        return type(self), ([*self],)
+
+    def add(self, card):
+        if card not in self:
+            super().add(card)
+            self.by_suit[card.suit].add(card)
+            self.by_value[card.value].add(card)
+
+    def discard(self, card):
+        if card in self:
+            super().discard(card)
+            self.by_suit[card.suit].discard(card)
+            self.by_value[card.value].discard(card)
+
+    def remove(self, card):
+        if card not in self:
+            raise KeyError(card)
+        self.discard(card)
+
+    def pop(self):
+        card = next(iter(self))
+        self.discard(card)
+        return card
+
+    def clear(self):
+        super().clear()
+        self.by_suit.clear()
+        self.by_value.clear()
+
+    def update(self, *others):
+        for cards in others:
+            for c in cards:
+                self.add(c)
+
+    def difference_update(self, *others):
+        for cards in others:
+            for c in cards:
+                self.discard(c)
+
+    def intersection_update(self, *others):
+        self.difference_update(self - set.intersection(set(self), *others))
+
+    def symmetric_difference_update(self, other):
+        other = set(other)
+        self.difference_update(self & other)
+        self.update(other - self)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
 @dataclass(frozen=True)
 class Player:
     name : str
     hand : list = field(default_factory=list)
-    capture : set = field(default_factory=set)
+    capture : Capture = field(default_factory=Capture)
+
+    def __post_init__(self):
+        if not isinstance(self.capture, Capture):
+            object.__setattr__(self, 'capture', Capture(self.capture))
 
     def match_cards(self, suit=None, value=None):
         match suit, value:
             case None, None:
                 return self.capture
             case Suit, None:
-                return [ c for c in self.capture if c.suit is Suit ]
+                return [*self.capture.by_suit.get(Suit, ())]
             case None, Value:
-                return [ c for c in self.capture if c.value is Value ]
+                return [*self.capture.by_value.get(Value, ())]
             case Suit, Value:
                 card = Card(suit=Suit, value=Value)
-                return [ c for c in self.capture if c == card ]
+                return [card] if card in self.capture else []
 
     def count_cards(self, suit=None, value=None):
-        return len(self.match_cards(suit=suit, value=value))
+        match suit, value:
+            case None, None:
+                return len(self.capture)
+            case Suit, None:
+                return len(self.capture.by_suit.get(Suit, ()))
+            case None, Value:
+                return len(self.capture.by_value.get(Value, ()))
+            case Suit, Value:
+                return int(Card(suit=Suit, value=Value) in self.capture)
 
     def show_cards(self, suit=None, value=None):
         return self.match_cards(suit=suit, value=value)
@@ -53,7 +143,6 @@ class Player:
     def __hash__(self):
         return hash(id(self))
 
-# TODO: implement the bonus point
 @dataclass(frozen=True, unsafe_hash=True)
 class Rule:
     player : Player
@@ -120,7 +209,7 @@ class LittleCassino(Rule, points=1):
         target = Card(value=Value.Two, suit=Suit.Spade)
 
         for pl in players:
-            if pl.count_cards(*target):
+            if pl.count_cards(value=target.value, suit=target.suit):
                 # print("*2S* lilcass", pl.name, target)
                 yield cls(player=pl, card=target)
 
@@ -138,6 +227,21 @@ class Ace(Rule, points=1):
                 # print("*A* aces", pl.name, type(c), c)
                 yield cls(player=pl, card=c)
 
+def score(players):
+    """Points for each player, with the bonus point for reaching 11"""
+    rules_by_player = defaultdict(set)
+
+    for r in Rule.from_players(players):
+        rules_by_player[r.player].add(r)
+
+    scores = {}
+    for p in players:
+        score = sum(r.points for r in rules_by_player[p])
+        if score >= 11:
+            score += 1
+        scores[p] = score
+    return scores
+
 #
 
 if __name__ == '__main__':
@@ -155,17 +259,8 @@ if __name__ == '__main__':
         rnd.choice([*players]).capture.add(c)
 
 
-    rules_by_player = defaultdict(set)
-
-    for r in Rule.from_players(players):
-        rules_by_player[r.player].add(r)
-
-
-    for p, rs in sorted(rules_by_player.items(), key=lambda pl_rs: pl_rs[0].name):
-        score = sum(r.points for r in rs)
-        if score >= 11:
-            score += 1
-        print(f'{f"{p.name}:":<10} {score:<3}')
+    for p, points in sorted(score(players).items(), key=lambda pl_pt: pl_pt[0].name):
+        print(f'{f"{p.name}:":<10} {points:<3}')
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from ref import Ace, BigCassino, Card, LittleCassino, MostCards, MostSpades
+from ref import STANDARD_DECK, Suit, Value
+
+# Columns of a capture matrix are cards in `STANDARD_DECK` order, the same
+# order as the engine's card codes.
+SPADES = np.array([c.suit == Suit.Spade for c in STANDARD_DECK])
+ACES = np.array([c.value == Value.Ace for c in STANDARD_DECK])
+BIG_CASSINO = STANDARD_DECK.index(Card(value=Value.Ten, suit=Suit.Diamond))
+LITTLE_CASSINO = STANDARD_DECK.index(Card(value=Value.Two, suit=Suit.Spade))
+
+
+def capture_matrix(states):
+    """Boolean (games × players × cards) matrix of finished `engine.State`s
+
+    Players are in each state's `players` order.
+    """
+    states = [*states]
+    n_players = max(len(s.players) for s in states)
+    captures = np.zeros((len(states), n_players, len(STANDARD_DECK)), dtype=bool)
+    for g, state in enumerate(states):
+        for p, player in enumerate(state.players):
+            captures[g, p, [c.code for c in state.capture[player.name]]] = True
+    return captures
+
+
+def _most(counts):
+    # Only a player with strictly more than everyone else gets the points
+    leaders = counts == counts.max(axis=-1, keepdims=True)
+    return leaders & (leaders.sum(axis=-1, keepdims=True) == 1)
+
+
+def score_batch(captures):
+    """Points per player for a batch of finished games
+
+    Takes a boolean (games × players × cards) capture matrix and returns
+    (games × players) points, the same as `ref.score` for each game.
+    """
+    captures = np.asarray(captures, dtype=bool)
+
+    points = MostCards.points * _most(captures.sum(axis=-1))
+    points += MostSpades.points * _most(captures[..., SPADES].sum(axis=-1))
+    points += BigCassino.points * captures[..., BIG_CASSINO]
+    points += LittleCassino.points * captures[..., LITTLE_CASSINO]
+    points += Ace.points * captures[..., ACES].sum(axis=-1)
+    points += points >= 11
+    return points
+
+
+# The same rules one game at a time, in plain Python, for callers scoring a
+# single state many times over (see `solver`) where NumPy's per-call overhead
+# costs more than the arithmetic.
+_SPADE_CODES = frozenset(np.flatnonzero(SPADES).tolist())
+_ACE_CODES = frozenset(np.flatnonzero(ACES).tolist())
+
+
+def _most_one(counts):
+    best = max(counts)
+    return [c == best and counts.count(best) == 1 for c in counts]
+
+
+def score_state(state):
+    """Points per player name for `state`'s capture piles, as `ref.score`"""
+    names = [p.name for p in state.players]
+    piles = [[c.code for c in state.capture[name]] for name in names]
+
+    points = [MostCards.points * m for m in _most_one([len(p) for p in piles])]
+    spades = _most_one([sum(c in _SPADE_CODES for c in p) for p in piles])
+    for i, pile in enumerate(piles):
+        points[i] += MostSpades.points * spades[i]
+        points[i] += Ace.points * sum(c in _ACE_CODES for c in pile)
+        points[i] += BigCassino.points * (BIG_CASSINO in pile)
+        points[i] += LittleCassino.points * (LITTLE_CASSINO in pile)
+        points[i] += points[i] >= 11
+    return dict(zip(names, points))
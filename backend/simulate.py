@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import islice
+from os import cpu_count
+from random import Random
+
+import ref
+from engine import game, Player
+
+
+def random_policy(state, player, moves, rnd):
+    return rnd.choice(moves)
+
+
+def score(state):
+    """Final `ref.Rule` points for each player's capture pile"""
+    players = [
+        ref.Player(name, capture={ref.STANDARD_DECK[c.code] for c in cards})
+        for name, cards in state.capture.items()
+    ]
+    return {p.name: points for p, points in ref.score(players).items()}
+
+
+def play_out(state, rnd, policy=random_policy):
+    """Play `state` to the end, returning the final state and the moves made"""
+    moves = 0
+    while not state.is_over:
+        player = state.player_order[0].name
+        move = policy(state, player, state.legal_moves(player), rnd)
+        state = state.with_move(player, move)
+        moves += 1
+    return state, moves
+
+
+def play(players, seed, policy=random_policy):
+    """Play one complete game, returning the final state and its length"""
+    return play_out(game(players, seed=seed), Random(seed), policy)
+
+
+@dataclass
+class Stats:
+    games: int = 0
+    lengths: Counter = field(default_factory=Counter)
+    scores: defaultdict = field(default_factory=lambda: defaultdict(Counter))
+    wins: Counter = field(default_factory=Counter)
+
+    def add(self, scores, length):
+        self.games += 1
+        self.lengths[length] += 1
+        for name, points in scores.items():
+            self.scores[name][points] += 1
+        # Ties for first all count as a win
+        best = max(scores.values())
+        self.wins.update(name for name, points in scores.items() if points == best)
+
+    def __add__(self, other):
+        scores = defaultdict(Counter, {n: Counter(c) for n, c in self.scores.items()})
+        for name, counts in other.scores.items():
+            scores[name] += counts
+        return Stats(
+            games=self.games + other.games,
+            lengths=self.lengths + other.lengths,
+            scores=scores,
+            wins=self.wins + other.wins,
+        )
+
+    @property
+    def mean_length(self):
+        return sum(n * c for n, c in self.lengths.items()) / self.games
+
+    def mean_score(self, name):
+        return sum(p * c for p, c in self.scores[name].items()) / self.games
+
+
+def play_many(players, seeds, policy=random_policy):
+    stats = Stats()
+    for seed in seeds:
+        state, length = play(players, seed, policy)
+        stats.add(score(state), length)
+    return stats
+
+
+def simulate(
+    n_games, players, seeds=0, policy=random_policy, *, workers=None, chunksize=500
+):
+    """Play `n_games` complete games across a process pool
+
+    `seeds` is either an iterable of per-game seeds or a single seed for the
+    `Random` that draws them. Every game is dealt and played from its own seed,
+    so the results only depend on the seeds, not on how games are split
+    between workers. Yields the running `Stats` each time a chunk finishes.
+    """
+    if isinstance(seeds, int):
+        rnd = Random(seeds)
+        seeds = (rnd.getrandbits(64) for _ in range(n_games))
+    seeds = islice(seeds, n_games)
+    chunks = iter(lambda: [*islice(seeds, chunksize)], [])
+
+    workers = workers or cpu_count()
+    total = Stats()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep every worker busy without queueing up millions of futures
+        pending = {
+            pool.submit(play_many, players, chunk, policy)
+            for chunk in islice(chunks, 2 * workers)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                total = total + f.result()
+            pending |= {
+                pool.submit(play_many, players, chunk, policy)
+                for chunk in islice(chunks, len(done))
+            }
+            yield total
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--games", type=int, default=10_000)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    players = [Player(name=f"Player {i}") for i in range(1, args.players + 1)]
+    for stats in simulate(args.games, players, args.seed, workers=args.workers):
+        print(f"\r{stats.games:>10,} games", end="", flush=True)
+    print()
+
+    print(f"{'length':<10} {stats.mean_length:.1f} moves")
+    for p in players:
+        print(
+            f'{f"{p.name}:":<10} {stats.mean_score(p.name):5.2f} points'
+            f" {stats.wins[p.name] / stats.games:6.1%} wins"
+        )
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from os import environ
+from random import Random
+from time import monotonic
+from typing import NamedTuple
+
+from engine import (
+    CARD_SUITS,
+    CARD_VALUES,
+    game,
+    MAX_VALUE,
+    Move,
+    Player,
+    STANDARD_DECK,
+    ZOBRIST_SEATS,
+)
+from ref import Ace, BigCassino, LittleCassino, MostCards, MostSpades
+from scoring import BIG_CASSINO, LITTLE_CASSINO, score_state
+
+SOLVER_BUDGET = float(environ.get("CASINO_SOLVER_BUDGET", 0.5))
+# Transposition table entries kept per `Solver`
+SOLVER_TABLE_SIZE = int(environ.get("CASINO_SOLVER_TABLE_SIZE", 1_000_000))
+# How many nodes to search between looks at the clock
+CHECK_EVERY = 256
+
+# Bounds stored in the transposition table
+EXACT, LOWER, UPPER = range(3)
+# The depth stored for a position searched to the end of the game
+FULL = float("inf")
+
+# Cards that only differ in ways no rule can see play the same, so a player
+# holding both only needs one of them searched. That's any two cards of the
+# same value, with the same spade-ness, neither of them a cassino.
+_CARD_CLASS = [
+    (
+        CARD_VALUES[code],
+        CARD_SUITS[code] == "Spade",
+        code if code in {BIG_CASSINO, LITTLE_CASSINO} else None,
+    )
+    for code in range(len(STANDARD_DECK))
+]
+
+
+# What each card adds to a capture pile: a card, maybe a spade, and the points
+# it scores on its own
+_CARD_SCORE = [
+    (
+        1,
+        int(CARD_SUITS[code] == "Spade"),
+        Ace.points * (CARD_VALUES[code] == 1)
+        + BigCassino.points * (code == BIG_CASSINO)
+        + LittleCassino.points * (code == LITTLE_CASSINO),
+    )
+    for code in range(len(STANDARD_DECK))
+]
+
+
+# Every class gets a random key per seat for the hands, like the engine's
+# Zobrist keys. Hands can hold two cards of a class, so the keys of a hand
+# are added up rather than XORed, and likewise for the table's units and the
+# capture piles, which get a key for each of their possible summaries. Those
+# are made as they're needed, sums of `hash`es of tuples collide too often.
+_CLASS_ID = [
+    {c: i for i, c in enumerate(dict.fromkeys(_CARD_CLASS))}[c] for c in _CARD_CLASS
+]
+_keys = Random(0x5011E)
+_HAND_KEYS = [
+    [_keys.getrandbits(64) for _ in range(max(_CLASS_ID) + 1)]
+    for _ in range(ZOBRIST_SEATS)
+]
+_TURN_KEYS = [_keys.getrandbits(64) for _ in range(ZOBRIST_SEATS)]
+_SUMMARY_KEYS = defaultdict(lambda: _keys.getrandbits(64))
+
+
+def _unit(value, match, cards, spades, points):
+    """A table unit as the search sees it
+
+    Its value (`None` if it hasn't got one), the value of a card that can
+    capture it on its own (0 if none can), what it adds to a capture pile and
+    its key. Which cards are in it never matters again.
+    """
+    summary = value, match, cards, spades, points
+    return *summary, _SUMMARY_KEYS[summary]
+
+
+def _summary(cards):
+    """What `cards` add to a capture pile, see `_CARD_SCORE`"""
+    return tuple(map(sum, zip((0, 0, 0), *(_CARD_SCORE[c.code] for c in cards))))
+
+
+_CARD_UNIT = [
+    _unit(CARD_VALUES[code], CARD_VALUES[code], *_CARD_SCORE[code])
+    for code in range(len(STANDARD_DECK))
+]
+
+
+def _subsets(table):
+    """Table positions of each set of valued units, by what they add up to"""
+    by_sum = [[] for _ in range(MAX_VALUE + 1)]
+
+    def extend(start, total, positions):
+        for t in range(start, len(table)):
+            value = table[t][0]
+            if value is not None and total + value <= MAX_VALUE:
+                by_sum[total + value].append((*positions, t))
+                extend(t + 1, total + value, (*positions, t))
+
+    extend(0, 0, ())
+    return by_sum
+
+
+class Solution(NamedTuple):
+    # The best move for the player to move, `None` when the game is over
+    move: Move | None
+    # The final points of every player when everyone plays the line found
+    scores: dict
+    # Whether the whole game tree was searched, otherwise `scores` are the
+    # points at the end of the last full `depth` moves
+    exact: bool
+    depth: int
+    nodes: int
+
+
+class _Timeout(Exception):
+    ...
+
+
+class Solver:
+    """Best play once the deck is empty, when every card is known
+
+    Alpha-beta with the player to move at the root (paranoid search)
+    maximizing their own final `ref.Rule` points and everyone else minimizing
+    them. The search doesn't go through `State`, building one per node costs
+    more than the rest of the search. A position is a tuple instead,
+
+        (key, seat to move, hands, table, capture piles, score)
+
+    with hands as tuples of card codes and the table and piles only as much
+    as the rules and the scores can see of them, in the same order as the
+    `State`'s so each `Move` means the same in both. Its key is kept up to
+    date by each move like `State.zobrist`, but positions that only differ
+    in cards no rule can tell apart, or the order of the table, share one.
+    The score (see `_score`) is filled in once it's needed.
+
+    Positions are cached by key in a transposition table of at most
+    `table_size` entries, dropping the oldest first, and the search deepens
+    a round of moves at a time until the tree is exhausted or the budget
+    runs out.
+    """
+
+    def __init__(self, table_size=SOLVER_TABLE_SIZE):
+        self.table_size = table_size
+        self.table = {}
+        self.nodes = 0
+
+    def _position(self, state):
+        """`state` as a search position, see `Solver`"""
+        seats = {p.name: seat for seat, p in enumerate(state.players)}
+        hands = tuple(tuple(c.code for c in state.hands[p.name]) for p in state.players)
+        table = []
+        for unit in state.table:
+            if unit.value is not None:
+                match = unit.value
+            elif len({c.value for c in unit.cards}) == 1:
+                match = unit.cards[0].value
+            else:
+                match = 0
+            table.append(_unit(unit.value, match, *_summary(unit.cards)))
+        piles = [
+            self._pile(seat, *_summary(state.capture[p.name]))
+            for seat, p in enumerate(state.players)
+        ]
+
+        turn = seats[state.player_order[0].name]
+        key = _TURN_KEYS[turn]
+        for seat, hand in enumerate(hands):
+            for code in hand:
+                key += _HAND_KEYS[seat][_CLASS_ID[code]]
+        key += sum(u[5] for u in table) + sum(p[3] for p in piles)
+        # Whose turn follows whose never changes
+        order = [seats[p.name] for p in state.player_order]
+        self._next = {seat: order[(i + 1) % len(order)] for i, seat in enumerate(order)}
+        return key, turn, hands, tuple(table), tuple(piles), None
+
+    def _pile(self, seat, cards, spades, points):
+        """A capture pile's (cards, spades, points) and its key
+
+        Only the root player's points count, everyone else's pile is keyed by
+        what it takes to beat it to the most cards and spades.
+        """
+        scored = points if seat == self._root else None
+        return cards, spades, points, _SUMMARY_KEYS[seat, cards, spades, scored]
+
+    def _score(self, piles):
+        """The root player's points if the game ended with these piles, and
+        the fewest and the most they can still end up with
+
+        At best they capture every card left, at worst they capture nothing
+        more and any one other player the lot. Piles only change with a
+        capture, so positions pass this on to the ones they lead to otherwise.
+        """
+        pile = piles[self._root]
+        cards, spades, points = self._cards, self._spades, self._points
+        most_cards = most_spades = 0
+        for seat, p in enumerate(piles):
+            cards -= p[0]
+            spades -= p[1]
+            points -= p[2]
+            if seat != self._root:
+                most_cards = max(most_cards, p[0])
+                most_spades = max(most_spades, p[1])
+
+        now = pile[2]
+        now += MostCards.points * (pile[0] > most_cards)
+        now += MostSpades.points * (pile[1] > most_spades)
+        low = pile[2]
+        low += MostCards.points * (pile[0] > most_cards + cards)
+        low += MostSpades.points * (pile[1] > most_spades + spades)
+        high = pile[2] + points
+        high += MostCards.points * (pile[0] + cards > most_cards)
+        high += MostSpades.points * (pile[1] + spades > most_spades)
+        return now + (now >= 11), low + (low >= 11), high + (high >= 11)
+
+    def solve(self, state, budget=SOLVER_BUDGET):
+        if state.deck:
+            raise ValueError("The deck isn't empty, the game isn't perfect information")
+        if state.is_over:
+            return Solution(None, score_state(state), True, 0, 0)
+
+        deadline = monotonic() + budget
+        self.nodes = 0
+        # Values are the root player's points, a new root needs a new table
+        self.table.clear()
+        names = [p.name for p in state.players]
+        self._root = names.index(state.player_order[0].name)
+        position = self._position(state)
+        _, _, hands, table, piles, _ = position
+        # Every card that can still end up in a pile, and what it's worth
+        self._cards, self._spades, self._points = (
+            sum(p[i] for p in piles)
+            + sum(u[2 + i] for u in table)
+            + sum(_CARD_SCORE[code][i] for hand in hands for code in hand)
+            for i in range(3)
+        )
+
+        best = None
+        plies = sum(map(len, hands))
+        # Cut off after whole rounds, so everyone has had as many moves
+        rounds = range(len(names), plies, len(names))
+        for depth in [*rounds, plies]:
+            try:
+                _, complete = self._search(position, depth, -1, 1 << 10, deadline)
+            except _Timeout:
+                break
+            best = depth
+            if complete:
+                break
+
+        if best is None:
+            raise TimeoutError("Not even one round could be searched in time")
+        line = self.principal_variation(state)
+        return Solution(
+            line[0] if line else None,
+            score_state(self._play(state, line)),
+            complete and best == depth,
+            best,
+            self.nodes,
+        )
+
+    def principal_variation(self, state):
+        """The moves the table says are best from `state` on"""
+        line = []
+        position = self._position(state)
+        seen = set()
+        while not state.is_over and position[0] not in seen:
+            seen.add(position[0])
+            _, low, high = score = self._score(position[4])
+            moves = self._moves(position, score)
+            if (entry := self.table.get(position[0])) is not None and entry[3]:
+                best = [m for m in moves if m[1][0] == entry[3]]
+            elif low == high:
+                # The search never looked past a position whose points were
+                # already settled, any move will do
+                best = moves
+            else:
+                break
+            if not best:
+                break
+            move, child = best[0]
+            player = state.player_order[0].name
+            if move not in state.legal_moves(player):
+                break
+            line.append(move)
+            state = state.with_move(player, move)
+            position = child
+        return line
+
+    @staticmethod
+    def _play(state, line):
+        for move in line:
+            state = state.with_move(state.player_order[0].name, move)
+        return state
+
+    def _store(self, key, depth, value, bound, best):
+        if key not in self.table and len(self.table) >= self.table_size:
+            del self.table[next(iter(self.table))]
+        self.table[key] = depth, value, bound, best
+
+    def _moves(self, position, score, hint=None):
+        """Each legal move and the position it leads to, one per position,
+        likely best first
+
+        Mirrors `State.legal_moves` and `State.with_move` once the deck is
+        empty. `score` is `position`'s, see `_score`.
+        """
+        key, seat, hands, table, piles, _ = position
+        hand = hands[seat]
+        hand_keys = _HAND_KEYS[seat]
+        pile = piles[seat]
+        key -= _TURN_KEYS[seat]
+        by_sum = None
+        classes = set()
+        seen = set()
+        moves = []
+        for card_idx, code in enumerate(hand):
+            if (cls := _CLASS_ID[code]) in classes:
+                continue
+            classes.add(cls)
+            value = CARD_VALUES[code]
+            rest = hand[:card_idx] + hand[card_idx + 1 :]
+            new_hands = hands[:seat] + (rest,) + hands[seat + 1 :]
+
+            # Whose turn it is next, skipping anyone out of cards
+            turn = self._next[seat]
+            for _ in range(len(hands) - 1):
+                if new_hands[turn]:
+                    break
+                turn = self._next[turn]
+            new_key = key - hand_keys[cls] + _TURN_KEYS[turn]
+
+            # Captures first, the more points and cards the better, then
+            # builds, then discards
+            unit = _CARD_UNIT[code]
+            if (child_key := new_key + unit[5]) not in seen:
+                seen.add(child_key)
+                moves.append(
+                    (
+                        2,
+                        Move("discard", card_idx),
+                        (child_key, turn, new_hands, table + (unit,), piles, score),
+                    )
+                )
+
+            for t, u in enumerate(table):
+                if u[0] is None or u[0] + value > MAX_VALUE:
+                    continue
+                total = u[0] + value
+                built = _unit(
+                    total, total, u[2] + unit[2], u[3] + unit[3], u[4] + unit[4]
+                )
+                if (child_key := new_key - u[5] + built[5]) in seen:
+                    continue
+                seen.add(child_key)
+                built_table = table[:t] + (built,) + table[t + 1 :]
+                moves.append(
+                    (
+                        1,
+                        Move("build", card_idx, t),
+                        (child_key, turn, new_hands, built_table, piles, score),
+                    )
+                )
+
+            if by_sum is None:
+                by_sum = _subsets(table)
+            targets = [*by_sum[value]]
+            targets.extend(
+                (t,) for t, u in enumerate(table) if u[0] is None and u[1] == value
+            )
+            for target in targets:
+                _, _, cards, spades, points, _ = unit
+                removed = 0
+                for t in target:
+                    u = table[t]
+                    cards += u[2]
+                    spades += u[3]
+                    points += u[4]
+                    removed += u[5]
+                captured = self._pile(
+                    seat, pile[0] + cards, pile[1] + spades, pile[2] + points
+                )
+                child_key = new_key - removed - pile[3] + captured[3]
+                if child_key in seen:
+                    continue
+                seen.add(child_key)
+                if len(target) == 1:
+                    left = table[: target[0]] + table[target[0] + 1 :]
+                else:
+                    left = tuple(u for t, u in enumerate(table) if t not in target)
+                moves.append(
+                    (
+                        -100 * points - cards,
+                        Move("capture", card_idx, target),
+                        (
+                            child_key,
+                            turn,
+                            new_hands,
+                            left,
+                            piles[:seat] + (captured,) + piles[seat + 1 :],
+                            None,
+                        ),
+                    )
+                )
+
+        # Whatever was best last time before all of them
+        moves.sort(key=lambda m: (m[2][0] != hint, m[0]))
+        return [(move, child) for _, move, child in moves]
+
+    def _search(self, position, depth, alpha, beta, deadline):
+        """The root player's points from `position`, searching `depth` more
+        moves, and whether no line was cut short by `depth`
+
+        Like any alpha-beta search the points are only exact between `alpha`
+        and `beta`, otherwise they're a bound.
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0 and monotonic() > deadline:
+            raise _Timeout
+
+        key, seat, hands, _, piles, score = position
+        score = score or self._score(piles)
+        now, low, high = score
+        if not any(hands):
+            return now, True
+        # Bounds hold however far the search goes, so they end it either way
+        if high <= alpha or low == high:
+            return high, True
+        if low >= beta:
+            return low, True
+        if depth == 0:
+            # Out of depth, score the captures so far
+            return now, False
+
+        hint = None
+        if (entry := self.table.get(key)) is not None:
+            stored_depth, value, bound, hint = entry
+            if stored_depth >= depth and (
+                bound == EXACT
+                or (bound == LOWER and value >= beta)
+                or (bound == UPPER and value <= alpha)
+            ):
+                return value, stored_depth == FULL
+
+        maximizing = seat == self._root
+        best_key = None
+        best = -1 if maximizing else 1 << 10
+        complete = True
+        lo, hi = alpha, beta
+        for _, child in self._moves(position, score, hint):
+            value, done = self._search(child, depth - 1, lo, hi, deadline)
+            complete &= done
+            if maximizing:
+                if value > best:
+                    best, best_key = value, child[0]
+                lo = max(lo, value)
+            else:
+                if value < best:
+                    best, best_key = value, child[0]
+                hi = min(hi, value)
+            if lo >= hi:
+                break
+
+        if best <= alpha:
+            bound = UPPER
+        elif best >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        # A subtree searched to the end is good for any depth
+        self._store(key, FULL if complete else depth, best, bound, best_key)
+        return best, complete
+
+
+def endgame(players, seed):
+    """A position from a random game, right as the deck runs out"""
+    state = game(players, seed=seed)
+    rnd = Random(seed)
+    while state.deck:
+        player = state.player_order[0].name
+        state = state.with_move(player, rnd.choice(state.legal_moves(player)))
+    return state
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=SOLVER_BUDGET)
+    args = parser.parse_args()
+
+    players = [Player(name=f"Player {i}") for i in range(1, args.players + 1)]
+    solver = Solver()
+    for seed in range(args.games):
+        state = endgame(players, seed)
+        start = monotonic()
+        solution = solver.solve(state, args.budget)
+        elapsed = monotonic() - start
+        print(
+            f"{seed:>4} {elapsed * 1e3:8.1f} ms {solution.nodes:>9,} nodes"
+            f" depth {solution.depth:>2} {'exact' if solution.exact else 'cut':<5}"
+            f" {solution.move}"
+        )
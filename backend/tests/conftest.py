@@ -0,0 +1,6 @@
+from os import environ
+from pathlib import Path
+from tempfile import mkdtemp
+
+# Keep the tests away from the real database
+environ.setdefault("CASINO_DB", str(Path(mkdtemp()) / "casino.db"))
@@ -0,0 +1,85 @@
+from collections import Counter
+from math import isnan
+from random import Random
+from time import monotonic
+
+from advisor import Advisor, determinize
+from engine import Card, game, Player, State, Unit
+
+PLAYERS = [Player(name="Hyacinth"), Player(name="Rose"), Player(name="Onslow")]
+
+
+def test_determinize():
+
+    state = game(PLAYERS, seed=0).with_discard("Hyacinth", 0)
+    sample = determinize(state, "Rose", Random(0))
+
+    hidden = lambda s: Counter(
+        c.code for c in s.deck + s.hands["Hyacinth"] + s.hands["Onslow"]
+    )
+    assert sample.hands["Rose"] == state.hands["Rose"]
+    assert sample.table == state.table
+    assert sample.capture == state.capture
+    assert sample.player_order == state.player_order
+    assert {n: len(h) for n, h in sample.hands.items()} == {
+        n: len(h) for n, h in state.hands.items()
+    }
+    assert len(sample.deck) == len(state.deck)
+    assert hidden(sample) == hidden(state)
+    assert sample.deck != state.deck
+
+
+def _capture_or_not():
+    """Rose can take the ten of diamonds, or throw it away"""
+    state = game(PLAYERS[:2], seed=0)
+    return State(
+        deck=[],
+        table=[Unit.from_card(Card(rank="Ten", suit="Diamond"))],
+        players=state.players,
+        player_order=[state.players[1], state.players[0]],
+        hands={
+            "Hyacinth": [Card(rank="Two", suit="Club")],
+            "Rose": [Card(rank="Ten", suit="Spade"), Card(rank="Three", suit="Heart")],
+        },
+        capture={"Hyacinth": [], "Rose": []},
+    )
+
+
+def test_advise():
+
+    state = _capture_or_not()
+    with Advisor(workers=0) as advisor:
+        *_, advice = advisor.advise(state, "Rose", budget=0.05, seed=0)
+
+    assert {a.move for a in advice} == set(state.legal_moves("Rose"))
+    best = advice[0]
+    assert best.move.action == "capture"
+    assert best.move.card_idx == 0
+    assert all(a.rollouts for a in advice)
+
+
+def test_advise_budget():
+
+    state = game(PLAYERS, seed=1)
+    start = monotonic()
+    with Advisor(workers=2, chunk=0.01) as advisor:
+        rankings = [*advisor.advise(state, "Hyacinth", budget=0.5, seed=0)]
+        elapsed = monotonic() - start
+        # The pool is kept for the next answer
+        assert [*advisor.advise(state, "Rose", budget=0.1)] == []
+
+    # One answer per finished chunk, each built on the last
+    assert len(rankings) > 1
+    totals = [sum(a.rollouts for a in advice) for advice in rankings]
+    assert totals == sorted(totals)
+    assert elapsed < 2
+
+
+def test_advise_only_move():
+
+    state = _capture_or_not()
+    state = state._replace(table=[], hands={**state.hands, "Rose": state.hands["Rose"][:1]})
+    with Advisor(workers=0) as advisor:
+        [[advice]] = advisor.advise(state, "Rose")
+    assert advice.move in state.legal_moves("Rose")
+    assert isnan(advice.score)
@@ -0,0 +1,310 @@
+from fastapi.testclient import TestClient
+from pytest import fixture, raises
+from starlette.websockets import WebSocketDisconnect
+
+import api
+import database
+from api import app, broadcaster, notifier, publish_state, states, views
+from database import insert_action, write
+from engine import Card, game, Move, Player
+from offload import Overloaded
+
+HEADERS = {"Origin": "http://localhost:3000"}
+PLAYERS = ["Hyacinth", "Onslow"]
+
+
+@fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def test_index(client):
+
+    assert client.get("/").json() == {"ping": "pong"}
+
+
+def test_game_create(client):
+
+    response = client.post(
+        "/v1/game/create", json={"players": PLAYERS}, headers=HEADERS
+    )
+    body = response.json()
+
+    assert response.status_code == 200
+    assert body["players"] == PLAYERS
+    assert body["game_id"]
+    assert body["error"] is None
+
+
+def test_game_state(client):
+
+    game_id = client.post(
+        "/v1/game/create", json={"players": PLAYERS}, headers=HEADERS
+    ).json()["game_id"]
+    response = client.get(f"/v1/game/{game_id}/state/", headers=HEADERS)
+
+    assert response.status_code == 200
+    assert response.json() == game([Player(name=p) for p in PLAYERS]).dict()
+
+
+def test_game_state_cached(client):
+
+    game_id = client.post(
+        "/v1/game/create", json={"players": PLAYERS}, headers=HEADERS
+    ).json()["game_id"]
+
+    hits = states.hits
+    client.get(f"/v1/game/{game_id}/state/", headers=HEADERS)
+    assert states.hits == hits + 1
+
+    states.invalidate(game_id)
+    response = client.get(f"/v1/game/{game_id}/state/", headers=HEADERS)
+    assert response.json() == game([Player(name=p) for p in PLAYERS]).dict()
+    assert states.version(game_id) == 0
+
+
+def test_game_ws(client):
+
+    players = [Player(name=p) for p in PLAYERS]
+    game_id = client.post(
+        "/v1/game/create", json={"players": PLAYERS}, headers=HEADERS
+    ).json()["game_id"]
+    state = game(players)
+    new_state = state.with_discard("Hyacinth", 0)
+
+    with client.websocket_connect(f"/v1/game/{game_id}/ws") as ws:
+        assert ws.receive_json() == {"version": 0, "state": state.dict()}
+        assert broadcaster.subscribers(game_id) == 1
+
+        client.portal.call(publish_state, game_id, 1, state, new_state)
+        message = ws.receive_json()
+
+    discarded = state.hands["Hyacinth"][0]
+    drawn = state.deck[-1]
+    assert message["version"] == 1
+    assert message["player_order"] == ["Onslow", "Hyacinth"]
+    assert message["table"] == [u.value for u in new_state.table]
+    assert message["moved"] == sorted(
+        [
+            {"card": discarded.dict(), "from": ["hand", "Hyacinth"], "to": ["table", 4]},
+            {"card": drawn.dict(), "from": ["deck"], "to": ["hand", "Hyacinth"]},
+        ],
+        key=lambda m: Card(**m["card"]).code,
+    )
+    assert states.version(game_id) == 1
+
+
+def test_game_view(client):
+
+    game_id = client.post(
+        "/v1/game/create", json={"players": PLAYERS}, headers=HEADERS
+    ).json()["game_id"]
+    state = game([Player(name=p) for p in PLAYERS])
+
+    response = client.get(f"/v1/game/{game_id}/view/Onslow/", headers=HEADERS)
+    body = response.json()
+    assert response.status_code == 200
+    assert response.headers["Access-Control-Allow-Origin"] == HEADERS["Origin"]
+    assert body["hand"] == [c.dict() for c in state.hands["Onslow"]]
+    assert body["hands"] == {"Hyacinth": 4, "Onslow": 4}
+    assert body["turn"] == "Hyacinth"
+
+    hits = views.hits
+    client.get(f"/v1/game/{game_id}/view/Onslow/", headers=HEADERS)
+    assert views.hits == hits + 1
+
+    # A new version makes a new view
+    client.portal.call(publish_state, game_id, 1, state, state.with_discard("Hyacinth", 0))
+    body = client.get(f"/v1/game/{game_id}/view/Onslow/", headers=HEADERS).json()
+    assert body["version"] == 1
+    assert body["turn"] == "Onslow"
+
+    response = client.get(f"/v1/game/{game_id}/view/Daisy/", headers=HEADERS)
+    assert response.status_code == 404
+
+
+def _new_game(client):
+    return client.post(
+        "/v1/game/create", json={"players": PLAYERS}, headers=HEADERS
+    ).json()["game_id"]
+
+
+def _action(client, game_id, player, action="discard", card_idx=0, **kwargs):
+    return client.post(
+        "/v1/game/action",
+        json={
+            "game_id": game_id,
+            "player": player,
+            "action": action,
+            "card_idx": card_idx,
+            **kwargs,
+        },
+        headers=HEADERS,
+    )
+
+
+def test_game_action(client):
+
+    game_id = _new_game(client)
+    state = game([Player(name=p) for p in PLAYERS])
+
+    response = _action(client, game_id, "Hyacinth", version=0)
+    assert response.status_code == 200
+    assert response.json() == {"game_id": game_id, "version": 1}
+
+    state = state.with_discard("Hyacinth", 0)
+    assert client.get(f"/v1/game/{game_id}/state/", headers=HEADERS).json() == state.dict()
+
+    # The action is what's stored, not the state
+    states.invalidate(game_id)
+    assert client.get(f"/v1/game/{game_id}/state/", headers=HEADERS).json() == state.dict()
+
+    move = state.legal_moves("Onslow")[-1]
+    response = _action(client, game_id, "Onslow", *move[:2], target=move.target)
+    assert response.json()["version"] == 2
+
+
+def test_game_action_invalid(client):
+
+    game_id = _new_game(client)
+
+    assert _action(client, game_id, "Onslow").status_code == 400
+    assert _action(client, game_id, "Hyacinth", card_idx=9).status_code == 400
+    assert _action(client, game_id, "Hyacinth", "shuffle").status_code == 400
+    assert _action(client, game_id, "Daisy").status_code == 404
+    # Malformed, rather than just not allowed
+    assert _action(client, game_id, "Hyacinth", card_idx=-1).status_code == 422
+    assert (
+        _action(client, game_id, "Hyacinth", "capture", target=-1).status_code == 422
+    )
+    assert (
+        _action(client, game_id, "Hyacinth", "capture", target=[0, -1]).status_code
+        == 422
+    )
+    assert states.version(game_id) == 0
+
+
+def test_game_missing(client):
+
+    game_id = 10**9
+    assert _action(client, game_id, "Hyacinth").status_code == 404
+    assert client.get(f"/v1/game/{game_id}/state/", headers=HEADERS).status_code == 404
+    assert (
+        client.get(f"/v1/game/{game_id}/view/Onslow/", headers=HEADERS).status_code
+        == 404
+    )
+    with client.websocket_connect(f"/v1/game/{game_id}/ws") as ws:
+        with raises(WebSocketDisconnect) as e:
+            ws.receive_json()
+    assert e.value.code == 4404
+    assert broadcaster.subscribers(game_id) == 0
+
+
+def test_game_action_conflict(client):
+
+    game_id = _new_game(client)
+    assert _action(client, game_id, "Hyacinth", version=0).status_code == 200
+
+    # Chosen before Hyacinth moved
+    response = _action(client, game_id, "Onslow", version=0)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "0"
+
+    # Another worker got a move in, this one's cache doesn't know yet. Our
+    # `notifier` would catch up on it at any moment, keep it out of the way.
+    client.portal.call(notifier.stop)
+    try:
+        client.portal.call(
+            write, insert_action, game_id, 2, "Onslow", Move("discard", 0), None
+        )
+        assert _action(client, game_id, "Onslow", version=1).status_code == 409
+        assert states.get(game_id) is None
+    finally:
+        client.portal.call(notifier.start)
+    assert _action(client, game_id, "Hyacinth", version=2).status_code == 200
+
+
+def test_game_action_stale_cache(client):
+
+    game_id = _new_game(client)
+    assert states.version(game_id) == 0
+
+    # Another worker moved, and the client heard about it before we did
+    client.portal.call(notifier.stop)
+    try:
+        client.portal.call(
+            write, insert_action, game_id, 1, "Hyacinth", Move("discard", 0), None
+        )
+        assert _action(client, game_id, "Onslow", version=1).status_code == 200
+        assert states.version(game_id) == 2
+    finally:
+        client.portal.call(notifier.start)
+
+
+def test_game_ws_other_worker(client):
+
+    game_id = _new_game(client)
+    state = game([Player(name=p) for p in PLAYERS])
+
+    with client.websocket_connect(f"/v1/game/{game_id}/ws") as ws:
+        assert ws.receive_json()["version"] == 0
+
+        # Written straight to the database, like another worker would
+        with database.pool.transaction() as c:
+            insert_action(c, game_id, 1, "Hyacinth", Move("discard", 0))
+        message = ws.receive_json()
+        assert message["version"] == 1
+        assert message["player_order"] == ["Onslow", "Hyacinth"]
+        assert states.version(game_id) == 1
+
+        # This worker's cache forgot the game
+        states.invalidate(game_id)
+        with database.pool.transaction() as c:
+            insert_action(c, game_id, 2, "Onslow", Move("discard", 0))
+        message = ws.receive_json()
+
+    state = state.with_discard("Hyacinth", 0).with_discard("Onslow", 0)
+    assert message == {"version": 2, "state": state.dict()}
+
+
+def test_game_state_other_worker(client):
+
+    game_id = _new_game(client)
+    assert states.version(game_id) == 0
+    with database.pool.transaction() as c:
+        insert_action(c, game_id, 1, "Hyacinth", Move("discard", 0))
+    client.portal.call(notifier.poll)
+
+    assert states.version(game_id) is None
+    assert _action(client, game_id, "Onslow", version=1).status_code == 200
+
+
+def test_metrics(client):
+
+    game_id = _new_game(client)
+    client.get(f"/v1/game/{game_id}/state/", headers=HEADERS)
+    _action(client, game_id, "Hyacinth")
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'casino_request_seconds_count{handler="game_state",method="GET",status="200"}' in text
+    assert 'casino_span_seconds_count{span="engine.with_move"}' in text
+    assert 'casino_span_seconds_count{span="db.insert_action"}' in text
+    assert f'casino_cache_hits_total{{cache="states"}} {states.hits}' in text
+    assert 'casino_offload_waiting{pool="db_read"} 0' in text
+
+
+def test_overloaded(client, monkeypatch):
+
+    game_id = _new_game(client)
+    states.invalidate(game_id)
+
+    async def overloaded(*args):
+        raise Overloaded("1024 calls are waiting already")
+
+    monkeypatch.setattr(api, "read", overloaded)
+    response = client.get(f"/v1/game/{game_id}/state/", headers=HEADERS)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,29 @@
+import api
+import database
+from bench.suite import BENCHMARKS, regressions, SIZES
+
+
+def test_benchmarks_run(monkeypatch):
+
+    # The benchmarks bring their own databases and caches, keep ours
+    monkeypatch.setattr(database, "pool", None)
+    monkeypatch.setattr(api, "states", api.states)
+    monkeypatch.setattr(api, "views", api.views)
+
+    # Only the smallest database, the others only take longer to fill
+    skip = {f"database.{op}[{size}]" for op in ["read", "insert"] for size in SIZES[1:]}
+    for name, bench in BENCHMARKS.items():
+        if name in skip:
+            continue
+        steps = bench()
+        fn = next(steps)
+        fn()
+        fn()
+        next(steps, None)
+
+
+def test_regressions():
+
+    baseline = {"a": 1.0, "b": 1.0, "c": 1.0}
+    results = {"a": 1.2, "b": 2.0, "d": 5.0}
+    assert regressions(results, baseline, tolerance=1.3) == {"b": 2.0}
@@ -0,0 +1,87 @@
+from asyncio import Event, run, sleep as async_sleep, wait_for
+
+import broadcast
+from broadcast import Broadcaster, SLOW_CLOSE_CODE
+
+
+class FakeSocket:
+    """Records what it's sent, and with `stall` never finishes sending"""
+
+    def __init__(self, stall=False):
+        self.stall = stall
+        self.sent = []
+        self.closed = None
+        self.got = Event()
+
+    async def send_json(self, message):
+        if self.stall:
+            await Event().wait()
+        self.sent.append(message)
+        self.got.set()
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+def test_broadcast_publish():
+
+    async def main():
+        broadcaster = Broadcaster()
+        ws = FakeSocket()
+        broadcaster.subscribe(1, ws)
+        for version in range(3):
+            broadcaster.publish(1, {"version": version})
+        broadcaster.publish(2, {"version": 0})
+        while len(ws.sent) < 3:
+            ws.got.clear()
+            await wait_for(ws.got.wait(), 1)
+        broadcaster.unsubscribe(1, ws)
+        return ws.sent, broadcaster.subscribers(1)
+
+    sent, subscribers = run(main())
+    assert sent == [{"version": 0}, {"version": 1}, {"version": 2}]
+    assert subscribers == 0
+
+
+def test_broadcast_stalled(monkeypatch):
+
+    monkeypatch.setattr(broadcast, "BROADCAST_TIMEOUT", 0.05)
+
+    async def main():
+        broadcaster = Broadcaster()
+        stalled, ws = FakeSocket(stall=True), FakeSocket()
+        broadcaster.subscribe(1, stalled)
+        broadcaster.subscribe(1, ws)
+        # Doesn't wait for either
+        broadcaster.publish(1, {"version": 0})
+        await wait_for(ws.got.wait(), 1)
+        await async_sleep(0.2)
+        return stalled, ws, broadcaster.subscribers(1)
+
+    stalled, ws, subscribers = run(main())
+    assert ws.sent == [{"version": 0}]
+    assert ws.closed is None
+    assert stalled.sent == []
+    assert stalled.closed == SLOW_CLOSE_CODE
+    assert subscribers == 1
+
+
+def test_broadcast_overflow(monkeypatch):
+
+    monkeypatch.setattr(broadcast, "BROADCAST_QUEUE", 2)
+
+    async def main():
+        broadcaster = Broadcaster()
+        stalled = FakeSocket(stall=True)
+        broadcaster.subscribe(1, stalled)
+        # One being sent, two queued, and the fourth doesn't fit
+        for version in range(4):
+            broadcaster.publish(1, {"version": version})
+            await async_sleep(0)
+        subscribers = broadcaster.subscribers(1)
+        await async_sleep(0.01)
+        return stalled, subscribers
+
+    stalled, subscribers = run(main())
+    assert subscribers == 0
+    assert stalled.closed == SLOW_CLOSE_CODE
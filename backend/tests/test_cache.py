@@ -0,0 +1,60 @@
+from cache import StateCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hits():
+
+    cache = StateCache(maxsize=2, ttl=10)
+
+    assert cache.get(1) is None
+    cache.put(1, 0, "one")
+
+    assert cache.get(1) == "one"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_versions():
+
+    cache = StateCache(maxsize=2, ttl=10)
+    cache.put(1, 3, "three")
+
+    # Older states never replace newer ones
+    cache.put(1, 2, "two")
+    assert cache.get(1) == "three"
+    assert cache.version(1) == 3
+    assert cache.lookup(1) == (3, "three")
+
+    assert cache.get(1, version=4) is None
+    assert 1 not in cache
+
+    cache.put(1, 4, "four")
+    cache.invalidate(1, version=4)
+    assert cache.get(1) == "four"
+    cache.invalidate(1, version=5)
+    assert cache.get(1) is None
+
+
+def test_cache_eviction():
+
+    clock = Clock()
+    cache = StateCache(maxsize=2, ttl=10, clock=clock)
+    cache.put(1, 0, "one")
+    cache.put(2, 0, "two")
+    cache.get(1)
+    cache.put(3, 0, "three")
+
+    # 2 was the least recently used
+    assert 2 not in cache
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+    clock.now = 10
+    assert cache.get(1) is None
+    assert len(cache) == 1
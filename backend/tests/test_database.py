@@ -0,0 +1,201 @@
+from asyncio import gather, run
+from json import dumps
+from random import Random
+from sqlite3 import connect
+
+from pytest import fixture, raises
+
+import codec
+import database
+from database import (
+    SNAPSHOT_INTERVAL,
+    create_game,
+    get_actions,
+    get_game_state,
+    group_commit,
+    init_db,
+    insert_action,
+    insert_game_state,
+    read,
+    replay_game_state,
+    write,
+)
+from engine import game, Player
+
+PLAYERS = [Player(name="Hyacinth"), Player(name="Onslow")]
+
+init_db()
+
+
+@fixture
+def c():
+    with database.pool.transaction() as c:
+        yield c
+
+
+def play(c, game_id, state, moves, start=0):
+    """Play and log random moves, returning the states they lead to"""
+    rnd = Random(start)
+    states = []
+    for version in range(start + 1, start + moves + 1):
+        player = state.player_order[0].name
+        move = rnd.choice(state.legal_moves(player))
+        state = state.with_move(player, move)
+        insert_action(c, game_id, version, player, move, state)
+        states.append(state)
+    return states
+
+
+def test_create_game(c):
+
+    game_id = create_game(c, PLAYERS, seed=3)
+    state = game(PLAYERS, seed=3)
+
+    assert replay_game_state(c, game_id) == state
+    assert get_game_state(c, game_id) == state.dict()
+
+
+def test_replay_game_state(c):
+
+    game_id = create_game(c, PLAYERS, seed=1)
+    insert_game_state(c, game_id, game(PLAYERS, seed=1))
+    states = [game(PLAYERS, seed=1)]
+    states += play(c, game_id, states[0], moves=40)
+
+    assert len(get_actions(c, game_id)) == 40
+    assert [v for v, *_ in get_actions(c, game_id, after=10, upto=12)] == [11, 12]
+
+    for version, state in enumerate(states):
+        assert replay_game_state(c, game_id, version) == state
+    assert get_game_state(c, game_id) == states[-1].dict()
+
+    # Only the periodic snapshots are stored
+    c.execute("SELECT version, state FROM state WHERE game_id=?", (game_id,))
+    rows = c.fetchall()
+    assert [r["version"] for r in rows] == [0, 16, 32]
+    # Full enough decks are stored as the game's seed
+    sizes = [
+        len(codec.encode(states[r["version"]])) - len(r["state"]) for r in rows
+    ]
+    assert sizes[0] == codec._RANK_BYTES[len(states[0].deck)] - 8
+    assert sizes[-1] == 0
+
+
+def test_missing_game(c):
+
+    with raises(database.MissingGame):
+        get_game_state(c, 10**9)
+
+
+def test_get_game_state_current(c):
+
+    game_id = create_game(c, PLAYERS, seed=2)
+    states = play(c, game_id, game(PLAYERS, seed=2), moves=SNAPSHOT_INTERVAL)
+
+    # Exactly on a snapshot, and between snapshots
+    assert get_game_state(c, game_id) == states[-1].dict()
+    states += play(c, game_id, states[-1], moves=3, start=SNAPSHOT_INTERVAL)
+    assert get_game_state(c, game_id) == states[-1].dict()
+
+    c.execute("SELECT * FROM current_state WHERE game_id=?", (game_id,))
+    assert c.fetchone()["version"] == SNAPSHOT_INTERVAL + 3
+
+
+def test_transactions():
+
+    with raises(ZeroDivisionError):
+        with database.pool.transaction() as c:
+            game_id = create_game(c, PLAYERS)
+            1 / 0
+
+    with database.pool.reader() as c:
+        c.execute("SELECT * FROM game WHERE id=?", (game_id,))
+        assert c.fetchone() is None
+
+
+def test_concurrent_requests():
+
+    async def requests():
+        return await gather(*(write(create_game, PLAYERS, seed) for seed in range(50)))
+
+    game_ids = run(requests())
+    assert len(set(game_ids)) == 50
+
+    async def reads():
+        return await gather(*(read(replay_game_state, gid) for gid in game_ids))
+
+    for seed, state in enumerate(run(reads())):
+        assert state == game(PLAYERS, seed=seed)
+
+
+def test_migrate(monkeypatch, tmp_path):
+
+    path = tmp_path / "legacy.db"
+    legacy = connect(path)
+    # The schema from before versions and the action log
+    legacy.executescript(
+        """
+        CREATE TABLE game (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            created     DATETIME DEFAULT CURRENT_TIMESTAMP,
+            modified    DATETIME DEFAULT CURRENT_TIMESTAMP,
+            name        TEXT,
+            players     JSON
+        );
+        CREATE TABLE state (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            created     DATETIME DEFAULT CURRENT_TIMESTAMP,
+            modified    DATETIME DEFAULT CURRENT_TIMESTAMP,
+            game_id     INTEGER,
+            state       JSON,
+            FOREIGN KEY (game_id) REFERENCES game(id)
+        );
+        """
+    )
+
+    states = [game(PLAYERS, seed=seed) for seed in range(3)]
+    game_id = legacy.execute(
+        "INSERT INTO game (players) VALUES (?)",
+        (dumps({"players": [p.dict() for p in PLAYERS]}),),
+    ).lastrowid
+    for state in states:
+        legacy.execute(
+            "INSERT INTO state (game_id, state) VALUES (?, ?)",
+            (game_id, dumps(state.dict())),
+        )
+    legacy.commit()
+    legacy.close()
+
+    monkeypatch.setattr(database, "pool", None)
+    init_db(path)
+    init_db(path)
+
+    with database.pool.reader() as c:
+        c.execute("PRAGMA user_version")
+        assert c.fetchone()["user_version"] == len(database.MIGRATIONS)
+        assert get_game_state(c, game_id) == states[-1].dict()
+        assert replay_game_state(c, game_id, 1) == states[1]
+    database.pool.close()
+
+
+def test_group_commit():
+
+    def fails(c):
+        create_game(c, PLAYERS)
+        raise ValueError("bad write")
+
+    async def requests():
+        writes = [write(create_game, PLAYERS, seed) for seed in range(200)]
+        results = await gather(*writes, write(fails), return_exceptions=True)
+        return results, group_commit()
+
+    (*game_ids, error), gc = run(requests())
+
+    assert isinstance(error, ValueError)
+    assert len(set(game_ids)) == 200
+    assert gc.writes == 201
+    assert gc.batches < gc.writes
+
+    with database.pool.reader() as c:
+        c.execute("SELECT COUNT(*) AS n FROM game WHERE id > ?", (max(game_ids),))
+        assert c.fetchone()["n"] == 0
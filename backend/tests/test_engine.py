@@ -1,8 +1,25 @@
 from collections import deque
+from random import Random
 from typing import List
+from pydantic import ValidationError
 from pytest import raises
 
-from engine import Card, Player, Rank, State, Suit, Unit, STANDARD_DECK
+from engine import (
+    Card,
+    MissingPlayerException,
+    Move,
+    NotTurnException,
+    Player,
+    Rank,
+    State,
+    Suit,
+    TableIndex,
+    Unit,
+    STANDARD_DECK,
+    game,
+    pack,
+    unpack,
+)
 
 # Smoke tests (that basically test that pytest is working). But maybe a
 # starting porint?
@@ -65,6 +82,35 @@ def test_cards():
     assert card.suit == "Spade"
 
 
+def test_card_codes():
+
+    for code, card in enumerate(STANDARD_DECK):
+        assert card.code == code
+        assert Card.from_code(code) is card
+        assert Card(rank=card.rank, suit=card.suit) == card
+        assert hash(Card(rank=card.rank, suit=card.suit)) == hash(card)
+        assert card.value == Card.VALUES[card.rank]
+
+    assert Card(suit=Suit.Spade, rank=Rank.Ace).code == 51
+    assert Card(suit=Suit.Diamond, rank=Rank.Two).code == 0
+
+    # Only codes of real cards
+    assert Unit(cards=[51]).cards == [STANDARD_DECK[51]]
+    for code in [-1, 52, True]:
+        with raises(ValidationError):
+            Unit(cards=[code])
+
+
+def test_pack():
+
+    packed = pack(DECK)
+
+    assert type(packed) is bytes
+    assert len(packed) == len(DECK)
+    assert unpack(packed) == DECK
+    assert all(a is b for a, b in zip(unpack(packed), STANDARD_DECK))
+
+
 def test_unit():
 
     cards = [Card(suit=Suit.Spade, rank=Rank.Ace), Card(suit=Suit.Heart, rank=Rank.Ace)]
@@ -102,6 +148,38 @@ def test_state():
     assert type(state) is State
 
 
+def test_state_packed():
+
+    player = Player(name="Hyacinth")
+    hand = DECK[:4]
+    unit = Unit(cards=pack(DECK[4:6]), value=None)
+
+    state = State(
+        deck=pack(DECK[6:]),
+        table=[unit],
+        players=[player],
+        hands={player.name: pack(hand)},
+        capture={player.name: b""},
+        player_order=[player],
+    )
+
+    assert unit.cards == DECK[4:6]
+    assert state.deck == DECK[6:]
+    assert state.hands[player.name] == hand
+    assert state.capture[player.name] == []
+
+
+def test_state_from_trusted():
+
+    state = _transition_state()
+    fields = {name: getattr(state, name) for name in State.__fields__}
+    trusted = State._from_trusted(**fields)
+
+    assert type(trusted) is State
+    assert trusted == State(**fields)
+    assert trusted.deck is state.deck
+
+
 def test_state_from_players():
 
     players = [
@@ -124,3 +202,183 @@ def test_state_from_players_named_the_same():
     ]
     state = State.from_players(DECK, players)
     assert len(state.hands.keys()) == 2
+
+
+def _transition_state():
+    players = [Player(name="Hyacinth"), Player(name="Onslow")]
+    hands = {
+        "Hyacinth": [Card(suit=Suit.Spade, rank=Rank.Ace)],
+        "Onslow": [Card(suit=Suit.Heart, rank=Rank.Four)],
+    }
+    table = [
+        Unit.from_card(Card(suit=Suit.Heart, rank=Rank.Ace)),
+        Unit.from_card(Card(suit=Suit.Club, rank=Rank.Two)),
+    ]
+    return State(
+        deck=[Card(suit=Suit.Club, rank=Rank.Nine), Card(suit=Suit.Club, rank=Rank.Ten)],
+        table=table,
+        players=players,
+        hands=hands,
+        capture={p.name: [] for p in players},
+        player_order=players,
+    )
+
+
+def test_with_discard():
+
+    state = _transition_state()
+    before = state.dict()
+    new_state = state.with_discard("Hyacinth", 0)
+
+    assert state.dict() == before
+    assert new_state.player_order[0].name == "Onslow"
+    assert new_state.hands["Hyacinth"] == [Card(suit=Suit.Club, rank=Rank.Ten)]
+    assert new_state.table[-1].cards == [Card(suit=Suit.Spade, rank=Rank.Ace)]
+    assert len(new_state.deck) == 1
+
+    # Untouched pieces are shared, not copied
+    assert new_state.hands["Onslow"] is state.hands["Onslow"]
+    assert new_state.table[0] is state.table[0]
+    assert new_state.capture is state.capture
+
+
+def test_with_build():
+
+    state = _transition_state()
+    before = state.dict()
+    new_state = state.with_build("Hyacinth", 0, 1)
+
+    assert state.dict() == before
+    assert len(new_state.table[1].cards) == 2
+    assert new_state.table[0] is state.table[0]
+    assert new_state.hands["Onslow"] is state.hands["Onslow"]
+
+
+def test_with_capture():
+
+    state = _transition_state()
+    before = state.dict()
+    new_state = state.with_capture("Hyacinth", 0, 0)
+
+    assert state.dict() == before
+    assert new_state.capture["Hyacinth"] == [
+        Card(suit=Suit.Heart, rank=Rank.Ace),
+        Card(suit=Suit.Spade, rank=Rank.Ace),
+    ]
+    assert new_state.capture["Onslow"] is state.capture["Onslow"]
+    assert len(new_state.table) == 1
+
+    with raises(ValueError):
+        state.with_capture("Hyacinth", 0, 1)
+    assert state.dict() == before
+
+    with raises(NotTurnException):
+        state.with_discard("Onslow", 0)
+    assert state.player_order[0].name == "Hyacinth"
+
+
+def test_legal_moves():
+
+    state = _transition_state()
+
+    assert state.legal_moves("Onslow") == []
+    with raises(MissingPlayerException):
+        state.legal_moves("Daisy")
+
+    # Ace of spades against a table of an ace and a two
+    assert set(state.legal_moves("Hyacinth")) == {
+        Move("discard", 0),
+        Move("build", 0, 0),
+        Move("build", 0, 1),
+        Move("capture", 0, (0,)),
+    }
+
+    state = state.with_discard("Hyacinth", 0).with_capture("Onslow", 0, (1, 2, 0))
+    assert state.capture["Onslow"] == [
+        Card(suit=Suit.Heart, rank=Rank.Ace),
+        Card(suit=Suit.Club, rank=Rank.Two),
+        Card(suit=Suit.Spade, rank=Rank.Ace),
+        Card(suit=Suit.Heart, rank=Rank.Four),
+    ]
+    assert state.table == []
+
+
+def test_table_index():
+
+    rnd = Random(0)
+    state = game([Player(name="Hyacinth"), Player(name="Onslow")], seed=0)
+    state.table_index
+
+    while state.deck:
+        player = state.player_order[0].name
+        moves = state.legal_moves(player)
+        captures = [m for m in moves if m.action == "capture"]
+        state = state.with_move(player, rnd.choice(captures or moves))
+
+        fresh = TableIndex.from_units(state.table)
+        assert state._table_index.size == len(state.table)
+        assert [sorted(m) for m in state._table_index.by_sum] == [
+            sorted(m) for m in fresh.by_sum
+        ]
+
+
+def test_diff():
+
+    state = _transition_state()
+    new_state = state.with_discard("Hyacinth", 0).with_capture("Onslow", 0, (0, 1, 2))
+
+    assert state.diff(state) == []
+    # In card code order
+    assert state.diff(new_state) == [
+        (Card(suit=Suit.Club, rank=Rank.Two), ("table", 1), ("capture", "Onslow")),
+        (Card(suit=Suit.Heart, rank=Rank.Four), ("hand", "Onslow"), ("capture", "Onslow")),
+        (Card(suit=Suit.Club, rank=Rank.Nine), ("deck",), ("hand", "Onslow")),
+        (Card(suit=Suit.Club, rank=Rank.Ten), ("deck",), ("hand", "Hyacinth")),
+        (Card(suit=Suit.Heart, rank=Rank.Ace), ("table", 0), ("capture", "Onslow")),
+        (Card(suit=Suit.Spade, rank=Rank.Ace), ("hand", "Hyacinth"), ("capture", "Onslow")),
+    ]
+
+
+def test_zobrist():
+
+    players = [Player(name="Hyacinth"), Player(name="Onslow"), Player(name="Daisy")]
+    for seed in range(20):
+        state = game(players, seed=seed)
+        rnd = Random(seed)
+        hashes = {state.zobrist}
+        while not state.is_over:
+            player = state.player_order[0].name
+            state = state.with_move(player, rnd.choice(state.legal_moves(player)))
+            # Kept up to date by the move, the same as hashing from scratch
+            assert state._zobrist is not None
+            assert state.zobrist == State(**state.dict()).zobrist
+            hashes.add(state.zobrist)
+        # Every state of a game is different, so is every fingerprint
+        assert len(hashes) > 40
+
+    # As many players as there are cards for
+    players = [Player(name=f"Player {i}") for i in range(12)]
+    state = game(players, seed=0)
+    assert not state.deck
+    moved = state.with_move("Player 0", state.legal_moves("Player 0")[0])
+    assert moved.zobrist == State(**moved.dict()).zobrist
+    assert len({state, moved}) == 2
+
+
+def test_zobrist_hash():
+
+    state = _transition_state()
+    same = _transition_state()
+    assert state == same and hash(state) == hash(same)
+    assert len({state, same, state.with_discard("Hyacinth", 0)}) == 2
+
+    # The turn, the deck's order, and which cards make up a unit all count
+    moved = state._replace(player_order=state.player_order[::-1])
+    shuffled = state._replace(deck=state.deck[::-1])
+    built = state.with_build("Hyacinth", 0, 0)
+    discarded = state.with_discard("Hyacinth", 0)
+    assert len({state, moved, shuffled, built, discarded}) == 5
+
+    # States that aren't played from a hashed one are hashed on first use
+    assert state.with_discard("Hyacinth", 0)._zobrist is not None
+    assert _transition_state().with_discard("Hyacinth", 0)._zobrist is None
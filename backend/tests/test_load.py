@@ -0,0 +1,52 @@
+from asyncio import run
+
+from httpx import AsyncClient
+from pytest import approx
+
+import api
+import database
+from bench.load import load, Stats
+
+
+def test_load(monkeypatch):
+
+    # The app's startup opens its own pool, keep ours
+    monkeypatch.setattr(database, "pool", None)
+
+    async def main():
+        await api.app.router.startup()
+        try:
+            async with AsyncClient(app=api.app, base_url="http://load") as client:
+                return await load(client, players=12, duration=1, poll=0.02, think=0)
+        finally:
+            await api.app.router.shutdown()
+            database.pool.close()
+
+    stats, elapsed = run(main())
+    report = stats.report(elapsed)
+
+    assert {"create", "state", "action", "total"} <= report.keys()
+    # One game per table of four, and another each time one ends
+    assert report["create"]["requests"] >= 3
+    for name in ["state", "action"]:
+        assert report[name]["requests"] > 0
+        assert report[name]["errors"] == 0
+    assert report["total"]["requests"] == sum(
+        r["requests"] for name, r in report.items() if name != "total"
+    )
+    assert report["total"]["p50"] <= report["total"]["p99"] <= report["total"]["max"]
+
+
+def test_stats():
+
+    stats = Stats()
+    stats.latencies["a"] = [0.001 * i for i in range(1, 101)]
+    stats.statuses["a"].update({200: 97, 409: 2, 500: 1})
+    report = stats.report(elapsed=10)["a"]
+
+    assert report["requests"] == 100
+    assert report["per_second"] == 10
+    assert report["p50"] == approx(0.051)
+    assert report["max"] == 0.1
+    assert report["conflicts"] == 0.02
+    assert report["errors"] == 0.01
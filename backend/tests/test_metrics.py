@@ -0,0 +1,87 @@
+from asyncio import run
+from time import perf_counter
+
+import metrics
+from metrics import Histogram, MetricsMiddleware, Registry, registry, span
+
+
+def test_histogram():
+
+    h = Histogram(buckets=(1, 5))
+    for value in [0.5, 1, 3, 10]:
+        h.observe(value)
+
+    assert h.count == 4
+    assert h.sum == 14.5
+    assert [*h.samples("x", {"a": "b"})] == [
+        ("x_bucket", {"a": "b", "le": "1"}, 2),
+        ("x_bucket", {"a": "b", "le": "5"}, 3),
+        ("x_bucket", {"a": "b", "le": "+Inf"}, 4),
+        ("x_sum", {"a": "b"}, 14.5),
+        ("x_count", {"a": "b"}, 4),
+    ]
+
+
+def test_registry_render():
+
+    r = Registry()
+    r.histogram("req_seconds", "Latency", handler="a").observe(0.001)
+    assert r.histogram("req_seconds", "Latency", handler="a").count == 1
+
+    @r.collector("hits_total", "counter", "Hits")
+    def hits():
+        return [({"cache": "x"}, 3)]
+
+    text = r.render()
+    assert "# HELP req_seconds Latency\n# TYPE req_seconds histogram\n" in text
+    assert 'req_seconds_bucket{handler="a",le="0.001"} 1\n' in text
+    assert 'req_seconds_count{handler="a"} 1\n' in text
+    assert '# TYPE hits_total counter\nhits_total{cache="x"} 3\n' in text
+
+
+def test_span():
+
+    with span("test.span"):
+        pass
+    with span("test.span"):
+        pass
+    assert span("test.span").histogram.count == 2
+    assert 'casino_span_seconds_count{span="test.span"} 2' in registry.render()
+
+
+async def _busy_app(scope, receive, send):
+    start = perf_counter()
+    while perf_counter() - start < 0.05:
+        pass
+    await send({"type": "http.response.start", "status": 204, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _busy_endpoint():
+    ...
+
+
+def test_middleware(monkeypatch):
+
+    profiles = []
+    monkeypatch.setattr(metrics, "profile_hook", lambda *a: profiles.append(a))
+
+    async def send(message):
+        ...
+
+    scope = {"type": "http", "method": "GET", "endpoint": _busy_endpoint}
+    run(MetricsMiddleware(_busy_app, profile_rate=1)(scope, None, send))
+
+    h = registry.histogram(
+        "casino_request_seconds",
+        "",
+        handler="_busy_endpoint",
+        method="GET",
+        status="204",
+    )
+    assert h.count == 1
+    assert h.sum >= 0.05
+
+    [(handler, stacks)] = profiles
+    assert handler == "_busy_endpoint"
+    assert any("_busy_app" in stack[-1] for stack in stacks)
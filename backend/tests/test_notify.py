@@ -0,0 +1,73 @@
+from asyncio import run
+
+import database
+from database import create_game, init_db, insert_action, insert_game_state
+from engine import game, Move, Player
+from notify import Notifier
+
+PLAYERS = [Player(name="Hyacinth"), Player(name="Onslow")]
+
+init_db()
+
+
+def _new_game():
+    with database.pool.transaction() as c:
+        game_id = create_game(c, PLAYERS)
+        insert_game_state(c, game_id, game(PLAYERS))
+    return game_id
+
+
+def _move(game_id, version):
+    # Any write to the database, as if from another worker
+    with database.pool.transaction() as c:
+        insert_action(c, game_id, version, "Hyacinth", Move("discard", 0))
+
+
+def test_notifier():
+
+    before = _new_game()
+
+    async def changes():
+        seen = []
+
+        async def on_change(game_id, version):
+            seen.append((game_id, version))
+
+        notifier = Notifier(on_change)
+        await notifier.start()
+        await notifier.poll()
+        assert seen == []
+
+        game_id = _new_game()
+        _move(before, 1)
+        await notifier.poll()
+        await notifier.poll()
+        assert seen == [(game_id, 0), (before, 1)]
+
+        # Only the latest version of a game that changed twice
+        _move(game_id, 1)
+        _move(game_id, 2)
+        await notifier.poll()
+        assert seen[2:] == [(game_id, 2)]
+        await notifier.stop()
+
+    run(changes())
+
+
+def test_notifier_errors():
+
+    async def changes():
+        async def on_change(game_id, version):
+            raise ValueError("bad subscriber")
+
+        notifier = Notifier(on_change)
+        await notifier.start()
+        _new_game()
+        _new_game()
+        await notifier.poll()
+        seq = notifier.seq
+        await notifier.poll()
+        return seq, notifier.seq
+
+    seq, after = run(changes())
+    assert seq == after
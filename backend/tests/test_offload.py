@@ -0,0 +1,145 @@
+from asyncio import gather, run, sleep as async_sleep
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep
+
+from pytest import raises
+
+import codec
+
+import database
+import offload
+import view
+from database import create_game, get_current_state, init_db, read, write
+from engine import game, MissingPlayerException, Move, Player
+from metrics import BUCKETS, Histogram, LoopMonitor
+from offload import Offload, Overloaded
+
+PLAYERS = [Player(name="Hyacinth"), Player(name="Onslow")]
+
+
+def test_offload_limit():
+
+    lock = Lock()
+    running = peak = 0
+
+    def work(i):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        sleep(0.01)
+        with lock:
+            running -= 1
+        return i
+
+    pool = Offload(lambda: ThreadPoolExecutor(8), limit=2)
+
+    async def main():
+        return await gather(*(pool.run(work, i) for i in range(10)))
+
+    assert run(main()) == [*range(10)]
+    assert peak == 2
+    assert pool.running == pool.waiting == 0
+    pool.close()
+
+
+def test_offload_overloaded():
+
+    pool = Offload(lambda: ThreadPoolExecutor(1), limit=1, max_waiting=2)
+
+    async def main():
+        # One running and two waiting, the next is turned away
+        calls = gather(*(pool.run(sleep, 0.05) for _ in range(3)))
+        await async_sleep(0.01)
+        assert pool.waiting == 2
+        with raises(Overloaded):
+            await pool.run(sleep, 0)
+        await calls
+        # Once they're done there's room again
+        await pool.run(sleep, 0)
+
+    run(main())
+    pool.close()
+
+
+def test_engine_processes(monkeypatch):
+
+    monkeypatch.setattr(offload, "ENGINE_PROCESSES", 1)
+    engine = Offload(offload.engine.make_executor, limit=1)
+    monkeypatch.setattr(offload, "engine", engine)
+
+    state = game(PLAYERS, seed=0)
+    move = Move("discard", 0)
+
+    async def main():
+        assert await offload.with_move(state, "Hyacinth", move) == state.with_move(
+            "Hyacinth", move
+        )
+        assert await offload.to_json(state) == codec.to_json(state)
+        assert await offload.view_json(state, 3, "Onslow") == view.to_json(
+            state, 3, "Onslow"
+        )
+        with raises(MissingPlayerException):
+            await offload.view_json(state, 3, "Daisy")
+
+    try:
+        run(main())
+    finally:
+        engine.close()
+
+
+def _lag(histogram):
+    """The largest bucket any lag landed in"""
+    return max(
+        ([*BUCKETS, float("inf")][i] for i, n in enumerate(histogram.counts) if n),
+        default=0,
+    )
+
+
+def test_event_loop_latency(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(database, "pool", None)
+    init_db(str(tmp_path / "offload.db"))
+    with database.pool.transaction() as c:
+        game_id = create_game(c, PLAYERS)
+        database.insert_game_state(c, game_id, game(PLAYERS))
+
+    def slow_read(c):
+        # A read that takes a while, like a replay from an old snapshot
+        sleep(0.002)
+        return get_current_state(c, game_id)
+
+    async def on_loop():
+        # What `read` did before it ran anything off the event loop
+        with database.pool.reader() as c:
+            return slow_read(c)
+
+    async def load(blocking):
+        histogram = Histogram()
+        monitor = LoopMonitor(interval=0.002, histogram=histogram)
+        await monitor.start()
+        if blocking:
+            await gather(*(on_loop() for _ in range(200)))
+        else:
+            await gather(
+                *(read(slow_read) for _ in range(200)),
+                *(write(create_game, PLAYERS) for _ in range(50)),
+            )
+        # Let the monitor see the last of it
+        await async_sleep(0.01)
+        await monitor.stop()
+        return histogram
+
+    try:
+        offloaded = run(load(blocking=False))
+        blocked = run(load(blocking=True))
+    finally:
+        database.pool.close()
+
+    # Every timer ran within a few milliseconds with hundreds of reads and
+    # writes in flight. Run on the loop, the reads hold up everything else
+    # until they're all done.
+    assert offloaded.count
+    assert _lag(offloaded) <= 0.025
+    assert _lag(blocked) >= 0.25
@@ -0,0 +1,66 @@
+from copy import copy
+from pickle import dumps, loads
+from random import Random
+
+from ref import Capture, Card, Player, STANDARD_DECK, Suit, Value
+
+
+def scan(cards, suit=None, value=None):
+    return [
+        c for c in cards
+        if (suit is None or c.suit is suit) and (value is None or c.value is value)
+    ]
+
+
+def test_player_counts():
+
+    rnd = Random(0)
+    player = Player('Alice')
+    cards = set()
+
+    for _ in range(200):
+        card = rnd.choice(STANDARD_DECK)
+        if rnd.random() < 0.7:
+            player.capture.add(card)
+            cards.add(card)
+        else:
+            player.capture.discard(card)
+            cards.discard(card)
+
+        for suit in [None, *Suit]:
+            for value in [None, *Value]:
+                expected = scan(cards, suit=suit, value=value)
+                assert player.count_cards(suit=suit, value=value) == len(expected)
+                assert sorted(player.show_cards(suit=suit, value=value)) == sorted(expected)
+
+
+def test_capture_set_operations():
+
+    spades = {c for c in STANDARD_DECK if c.suit is Suit.Spade}
+    aces = {c for c in STANDARD_DECK if c.value is Value.Ace}
+
+    capture = Capture(spades)
+    capture |= aces
+    capture -= {Card(value=Value.Ace, suit=Suit.Heart)}
+    capture &= spades | {Card(value=Value.Ace, suit=Suit.Club)}
+
+    assert capture == spades | {Card(value=Value.Ace, suit=Suit.Club)}
+    assert capture.by_value[Value.Ace] == {
+        Card(value=Value.Ace, suit=Suit.Spade),
+        Card(value=Value.Ace, suit=Suit.Club),
+    }
+    assert capture.by_suit[Suit.Spade] == spades
+
+    for new in [copy(capture), loads(dumps(capture))]:
+        new.clear()
+        assert not new.by_suit
+        assert capture.by_suit[Suit.Spade] == spades
+
+
+def test_player_from_set():
+
+    player = Player('Bob', capture={*STANDARD_DECK[:8]})
+
+    assert type(player.capture) is Capture
+    assert player.count_cards(value=Value.Two) == 4
+    assert player.count_cards(suit=Suit.Club) == 2
@@ -0,0 +1,58 @@
+from random import Random
+
+import numpy as np
+
+import ref
+from engine import Player
+from scoring import capture_matrix, score_batch, score_state
+from simulate import play, score
+
+
+def test_score_batch():
+
+    rnd = Random(0)
+    games = []
+    for _ in range(500):
+        players = [ref.Player(name) for name in "ABCD"[: rnd.randint(2, 4)]]
+        for c in ref.STANDARD_DECK:
+            # Leave some cards uncaptured so that ties come up
+            if rnd.random() < 0.8:
+                rnd.choice(players).capture.add(c)
+        games.append(players)
+
+    for players in games:
+        captures = np.zeros((1, len(players), len(ref.STANDARD_DECK)), dtype=bool)
+        for p, pl in enumerate(players):
+            for c in pl.capture:
+                captures[0, p, ref.STANDARD_DECK.index(c)] = True
+
+        scores = ref.score(players)
+        assert score_batch(captures)[0].tolist() == [scores[pl] for pl in players]
+
+
+def test_score_batch_bonus():
+
+    captures = np.zeros((1, 2, len(ref.STANDARD_DECK)), dtype=bool)
+    captures[0, 0] = True
+
+    # 3 most cards + 1 most spades + 2 + 1 cassinos + 4 aces, and the bonus
+    assert score_batch(captures).tolist() == [[12, 0]]
+
+
+def test_capture_matrix():
+
+    players = [Player(name="Hyacinth"), Player(name="Rose"), Player(name="Daisy")]
+    states = [play(players, seed)[0] for seed in range(5)]
+
+    points = score_batch(capture_matrix(states))
+
+    for state, row in zip(states, points):
+        scores = score(state)
+        assert row.tolist() == [scores[p.name] for p in players]
+
+
+def test_score_state():
+
+    for seed in range(50):
+        state, _ = play([Player(name=n) for n in "ABCD"[: 2 + seed % 3]], seed)
+        assert score_state(state) == score(state)
@@ -1,8 +1,11 @@
 from collections import deque
+from random import Random
 from typing import List
+import orjson
 from pytest import raises
 
-from engine import Card, Player, Rank, State, Suit, Unit, STANDARD_DECK
+import codec
+from engine import Card, game, Player, Rank, State, Suit, Unit, STANDARD_DECK
 
 DECK = [c for c in STANDARD_DECK]
 
@@ -137,3 +140,92 @@ def test_state_serialization():
 
     assert serilaized == state_serialized
     assert type(new_state) is State
+
+
+def _played_state():
+    players = [Player(name="Hyacinth"), Player(name="Onslow", points=3)]
+    state = State.from_players(DECK, players)
+    for _ in range(12):
+        player = state.player_order[0].name
+        state = state.with_move(player, state.legal_moves(player)[-1])
+    return state
+
+
+def test_codec_round_trip():
+    state = State(**state_serialized)
+    assert codec.decode(codec.encode(state)) == state
+
+    state = _played_state()
+    decoded = codec.decode(codec.encode(state))
+    assert decoded == state
+    assert type(decoded) is State
+    assert decoded.table == state.table
+
+
+def test_codec_dict():
+    state = State(**state_serialized)
+    assert codec.to_dict(state) == state_serialized
+
+    state = _played_state()
+    assert codec.to_dict(state) == state.dict()
+    assert orjson.loads(codec.to_json(state)) == state.dict()
+
+
+def test_codec_errors():
+    data = codec.encode(_played_state())
+    with raises(codec.DecodeError):
+        codec.decode(data[:-1])
+    with raises(codec.DecodeError):
+        codec.decode(data + b"\0")
+    with raises(codec.DecodeError):
+        codec.decode(bytes([codec.VERSION + 1]) + data[1:])
+
+
+def test_rank_deck():
+    rnd = Random(0)
+    for count in [0, 1, 2, 20, 51, 52]:
+        for _ in range(10):
+            deck = rnd.sample(DECK, count)
+            rank = codec.rank_deck(deck)
+            assert rank.bit_length() <= 226
+            assert codec.unrank_deck(rank, count) == deck
+
+    assert codec.rank_deck(DECK) == 0
+    assert codec.unrank_deck(0, 52) == DECK
+    with raises(codec.DecodeError):
+        codec.unrank_deck(1, 0)
+
+
+def test_codec_seeded():
+    players = [Player(name="Hyacinth"), Player(name="Onslow", points=3)]
+    state = game(players, seed=5)
+    for _ in range(12):
+        seeded = codec.encode(state, seed=5)
+        assert codec.decode(seeded) == state
+        # Only the seed and how many cards are left
+        assert len(seeded) == len(codec.encode(state)) - max(
+            0, codec._RANK_BYTES[len(state.deck)] - 8
+        )
+        player = state.player_order[0].name
+        state = state.with_move(player, state.legal_moves(player)[-1])
+
+    # Any other seed is stored ranked
+    assert codec.encode(state, seed=6) == codec.encode(state)
+    assert codec.decode(codec.encode(state, seed=6)) == state
+
+
+def test_codec_version_1():
+    # Before the deck had its own encoding it was stored like a hand
+    state = _played_state()
+    data = codec.encode(state)
+    deck = 3 + len(state.player_order) + sum(
+        2 + len(p.name.encode()) + 4 for p in state.players
+    )
+    rank = 2 + codec._RANK_BYTES[len(state.deck)]
+    old = (
+        bytes([1])
+        + data[1:deck]
+        + bytes([len(state.deck), *(c.code for c in state.deck)])
+        + data[deck + rank :]
+    )
+    assert codec.decode(old) == state
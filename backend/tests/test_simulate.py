@@ -0,0 +1,43 @@
+from engine import Player, STANDARD_DECK
+from simulate import play, play_many, score, simulate
+
+PLAYERS = [
+    Player(name="Hyacinth"),
+    Player(name="Rose"),
+    Player(name="Daisy"),
+]
+
+
+def test_play():
+
+    state, moves = play(PLAYERS, seed=0)
+
+    assert state.is_over
+    assert state.deck == []
+    # Every card but the four first dealt to the table gets played
+    assert moves == len(STANDARD_DECK) - 4
+
+    cards = [
+        *(c for u in state.table for c in u.cards),
+        *(c for cards in state.capture.values() for c in cards),
+    ]
+    assert sorted(c.code for c in cards) == [*range(len(STANDARD_DECK))]
+    assert set(score(state)) == {p.name for p in PLAYERS}
+
+
+def test_simulate():
+
+    *_, stats = simulate(20, PLAYERS, seeds=range(20), workers=2, chunksize=3)
+
+    assert stats.games == 20
+    assert stats == play_many(PLAYERS, range(20))
+    assert sum(stats.lengths.values()) == 20
+    assert all(sum(c.values()) == 20 for c in stats.scores.values())
+
+
+def test_simulate_deterministic():
+
+    *_, first = simulate(10, PLAYERS, seeds=7, workers=2, chunksize=4)
+    *_, second = simulate(10, PLAYERS, seeds=7, workers=1, chunksize=10)
+
+    assert first == second
@@ -0,0 +1,86 @@
+from random import Random
+from time import monotonic
+
+from pytest import raises
+
+from engine import game, Player
+from scoring import score_state
+from solver import endgame, Solver
+
+PLAYERS = [Player(name="Hyacinth"), Player(name="Rose"), Player(name="Onslow")]
+FOUR = [*PLAYERS, Player(name="Daisy")]
+
+
+def _late(seed, cards):
+    """An endgame played on at random until `cards` cards are left in hand"""
+    state = endgame(PLAYERS, seed)
+    rnd = Random(seed)
+    while sum(map(len, state.hands.values())) > cards:
+        player = state.player_order[0].name
+        state = state.with_move(player, rnd.choice(state.legal_moves(player)))
+    return state
+
+
+def _minimax(state, root):
+    """Paranoid minimax without any pruning, the slow way"""
+    if state.is_over:
+        return score_state(state)[root]
+    player = state.player_order[0].name
+    values = [
+        _minimax(state.with_move(player, move), root)
+        for move in state.legal_moves(player)
+    ]
+    return max(values) if player == root else min(values)
+
+
+def test_solve():
+
+    for seed in range(5):
+        state = _late(seed, 5)
+        root = state.player_order[0].name
+        solution = Solver().solve(state, budget=10)
+
+        assert solution.exact
+        assert solution.move in state.legal_moves(root)
+        assert solution.scores[root] == _minimax(state, root)
+
+
+def test_solve_deck():
+
+    with raises(ValueError):
+        Solver().solve(game(PLAYERS, seed=0))
+
+
+def test_solve_over():
+
+    state = _late(0, 0)
+    assert state.is_over
+    solution = Solver().solve(state)
+    assert solution.move is None
+    assert solution.exact
+    assert solution.scores == score_state(state)
+
+
+def test_solve_endgame():
+
+    state = endgame(FOUR, 0)
+    solver = Solver()
+    start = monotonic()
+    solution = solver.solve(state, budget=1)
+
+    assert monotonic() - start < 1
+    assert solution.exact
+    assert solution.depth == sum(map(len, state.hands.values()))
+    assert solver._play(state, solver.principal_variation(state)).is_over
+
+
+def test_solve_budget():
+
+    state = endgame(FOUR, 9)
+    solver = Solver(table_size=1_000)
+    solution = solver.solve(state, budget=0.05)
+
+    assert not solution.exact
+    assert 0 < solution.depth < sum(map(len, state.hands.values()))
+    assert solution.move in state.legal_moves(state.player_order[0].name)
+    assert len(solver.table) <= 1_000
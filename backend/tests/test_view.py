@@ -0,0 +1,38 @@
+from orjson import loads
+from pytest import raises
+
+from engine import Card, game, MissingPlayerException, Player
+from view import PlayerView, player_view, to_json
+
+PLAYERS = [Player(name="Hyacinth"), Player(name="Onslow")]
+
+
+def test_player_view():
+    state = game(PLAYERS).with_discard("Hyacinth", 0)
+    view = player_view(state, 1, "Hyacinth")
+
+    assert view["version"] == 1
+    assert view["player"] == "Hyacinth"
+    assert view["turn"] == "Onslow"
+    assert view["hand"] == [c.dict() for c in state.hands["Hyacinth"]]
+    assert view["table"] == [u.dict() for u in state.table]
+    assert view["deck"] == len(state.deck)
+    assert view["hands"] == {"Hyacinth": 4, "Onslow": 4}
+    assert view["captured"] == {"Hyacinth": 0, "Onslow": 0}
+    # Matches the model the endpoint documents
+    assert PlayerView(**view).dict() == view
+
+
+def test_player_view_hides_cards():
+    state = game(PLAYERS)
+    view = loads(to_json(state, 0, "Onslow"))
+
+    shown = view["hand"] + [c for u in view["table"] for c in u["cards"]]
+    hidden = state.deck + state.hands["Hyacinth"]
+    assert not {Card(**c) for c in shown} & set(hidden)
+    assert len(to_json(state, 0, "Onslow")) * 4 < len(state.json())
+
+
+def test_player_view_missing_player():
+    with raises(MissingPlayerException):
+        player_view(game(PLAYERS), 0, "Daisy")
@@ -0,0 +1,50 @@
+from typing import Dict, List
+
+from orjson import dumps
+from pydantic import BaseModel
+
+from codec import CARD_DICTS
+from engine import Card, Unit
+
+
+class PlayerView(BaseModel):
+    """What one player is allowed to see of a game
+
+    Their own hand and the table in full, but only the sizes of the deck and
+    of everyone's hands and capture piles.
+    """
+
+    version: int
+    player: str
+    turn: str | None
+    hand: List[Card]
+    table: List[Unit]
+    deck: int
+    hands: Dict[str, int]
+    captured: Dict[str, int]
+
+
+def player_view(state, version, player):
+    """`PlayerView` of `state` as a dict, without building the model
+
+    Raises `MissingPlayerException` for a player that isn't in the game.
+    """
+    state._find_player(player)
+    capture = state.capture or {}
+    return {
+        "version": version,
+        "player": player,
+        "turn": None if state.is_over else state.player_order[0].name,
+        "hand": [CARD_DICTS[c.code] for c in state.hands.get(player, ())],
+        "table": [
+            {"cards": [CARD_DICTS[c.code] for c in u.cards], "value": u.value}
+            for u in state.table
+        ],
+        "deck": len(state.deck),
+        "hands": {name: len(cards) for name, cards in state.hands.items()},
+        "captured": {p.name: len(capture.get(p.name, ())) for p in state.players},
+    }
+
+
+def to_json(state, version, player):
+    return dumps(player_view(state, version, player))
@@ -1,9 +1,8 @@
 import { useDrop } from "react-dnd";
 import { useState, useEffect } from "react";
 
-import { useQuery } from "react-query";
 import Hand from "../../components/Hand";
-import { FetchState } from "../../requests/stateRequests";
+import { SubscribeState } from "../../requests/stateRequests";
 
 const fakeAPIResponse = {
   table: [
@@ -25,15 +24,20 @@ export default function GamePlayPage() {
   const [table, setTable] = useState(fakeAPIResponse.table);
   const [player, setPlayer] = useState(fakeAPIResponse.player);
 
-  const { isLoading, isFetching, error, data } = useQuery({
-    queryKey: ["gameState"], // We prob don't want to cache this
-    queryFn: () => FetchState(1), // Need game ID
-  });
+  const [data, setData] = useState(null);
+  const [error, setError] = useState(null);
+
+  // Pushed on every change, rather than polled
   useEffect(() => {
-    if (isFetching) {
-      return;
-    }
-    if (!isFetching && data) {
+    const socket = SubscribeState(
+      1, // Need game ID
+      setData,
+      () => setError(new Error("Lost the connection to the game"))
+    );
+    return () => socket.close();
+  }, []);
+  useEffect(() => {
+    if (data) {
       const hands = data["hands"];
       const firstPlayer = hands[Object.keys(hands)[0]]
 
@@ -47,7 +51,7 @@ export default function GamePlayPage() {
       setPlayer(firstPlayer);
       setTable(_table);
     }
-  }, [isFetching]);
+  }, [data]);
 
   const addPlayer = (c) => setPlayer([...player, c]);
   const playerPopIndex = (i) => {
@@ -109,7 +113,7 @@ export default function GamePlayPage() {
     [table, player]
   );
 
-  if (isLoading) return <p>Loading...</p>;
+  if (data === null && !error) return <p>Loading...</p>;
   if (error) return <p>An error has occurred: {error.message}</p>;
 
   // console.log(data)
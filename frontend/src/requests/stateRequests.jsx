@@ -10,3 +10,103 @@ export const FetchState = (gid) => {
 
   return response;
 };
+
+// A state with a `broadcast.delta` applied: each moved card is taken from where
+// it was and put where it went, see `State.locations` for where that can be.
+export const ApplyDelta = (state, delta) => {
+  const same = (a, b) => a.rank === b.rank && a.suit === b.suit;
+  const hands = Object.fromEntries(
+    Object.entries(state.hands).map(([name, cards]) => [name, [...cards]])
+  );
+  const capture = Object.fromEntries(
+    Object.entries(state.capture || {}).map(([name, cards]) => [name, [...cards]])
+  );
+  let deck = [...state.deck];
+  const table = state.table.map((unit) => [...unit.cards]);
+
+  const pile = ([where, key]) =>
+    ({ deck, hand: hands[key], table: table[key], capture: capture[key] }[where]);
+
+  for (const { card, from } of delta.moved) {
+    if (from === null) {
+      continue;
+    }
+    const cards = pile(from);
+    cards.splice(cards.findIndex((c) => same(c, card)), 1);
+  }
+
+  // Units keep their index unless they moved, then they show up as moved
+  const units = delta.table.map((value, idx) => ({
+    cards: table[idx] || [],
+    value,
+  }));
+  for (const { card, to } of delta.moved) {
+    if (to === null) {
+      continue;
+    }
+    const [where, key] = to;
+    if (where === "table") {
+      units[key].cards.push(card);
+    } else if (where === "hand") {
+      hands[key].push(card);
+    } else if (where === "capture") {
+      (capture[key] = capture[key] || []).push(card);
+    } else {
+      deck.push(card);
+    }
+  }
+
+  const players = Object.fromEntries(state.players.map((p) => [p.name, p]));
+  return {
+    ...state,
+    deck,
+    table: units,
+    hands,
+    capture:
+      state.capture === null && !Object.keys(capture).length ? null : capture,
+    player_order: delta.player_order.map((name) => players[name]),
+  };
+};
+
+// Follow a game over a websocket instead of polling its state. `onState` is
+// called with the whole state when it first arrives and again after every
+// change. Returns the socket, close it to unsubscribe.
+export const SubscribeState = (gid, onState, onError) => {
+  const socket = new WebSocket(`${API.replace(/^http/, "ws")}/v1/game/${gid}/ws`);
+  let state = null;
+  let version = -1;
+  // Deltas published while we connected can arrive before the state, they
+  // wait for it
+  let early = [];
+
+  // Only deltas past the state's version are news
+  const apply = (delta) => {
+    if (delta.version <= version) {
+      return false;
+    }
+    version = delta.version;
+    state = ApplyDelta(state, delta);
+    return true;
+  };
+
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if ("state" in message) {
+      state = message.state;
+      version = message.version;
+      early.forEach(apply);
+      early = [];
+    } else if (state === null) {
+      early.push(message);
+      return;
+    } else if (!apply(message)) {
+      return;
+    }
+    onState(state);
+  };
+  if (onError) {
+    socket.onerror = onError;
+  }
+
+  return socket;
+};